@@ -0,0 +1,166 @@
+"""
+A local stand-in for the Google Calendar v3 API, covering the events methods and the batch endpoint the updater uses
+"""
+import itertools
+import json
+import re
+import threading
+from datetime import datetime
+from email.parser import BytesParser, Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+EVENTS_PATH_REGEX = r"^/calendar/v3/calendars/(?P<calendar>[^/]+)/events(?:/(?P<event>[^/]+))?$"
+BATCH_PATH = "/batch/calendar/v3"
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeCalendarHandler)
+        self.calendars = dict()  # calendar ID -> event ID -> event
+        self.changes = list()  # (sequence, calendar ID, event) for sync tokens
+        self.calls = dict()  # method -> count
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def build_service(self, credentials, request_builder):
+        """
+        Builds a Calendar API service against this server, the same way src.calendar_client does against Google's
+        """
+        document = json.loads(get_static_doc("calendar", "v3"))
+        document["rootUrl"] = self.url
+        return build_from_document(document, credentials=credentials, requestBuilder=request_builder)
+
+    def dispatch(self, method: str, path: str, body: bytes):
+        """
+        :return: the status code and the JSON response of a single API call
+        """
+        url = urlparse(path)
+        match = re.match(EVENTS_PATH_REGEX, url.path)
+        if not match:
+            return 404, {"error": {"code": 404, "message": f"Not found: {url.path}"}}
+        calendar_id, event_id = unquote(match["calendar"]), match["event"] and unquote(match["event"])
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self._lock:
+            name = {"GET": "list", "POST": "insert", "PATCH": "patch", "PUT": "update", "DELETE": "delete"}[method]
+            self.calls[name] = self.calls.get(name, 0) + 1
+            events = self.calendars.setdefault(calendar_id, dict())
+            if method == "GET":
+                return self._list(calendar_id, events, params)
+            if method == "POST":
+                event = json.loads(body)
+                event["id"] = f"event{next(self._ids)}"
+                event["htmlLink"] = f"{self.url}event?eid={event['id']}"
+                events[event["id"]] = event
+                self._record_change(calendar_id, event)
+                return 200, event
+            if event_id not in events:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            if method == "DELETE":
+                event = events.pop(event_id)
+                self._record_change(calendar_id, {**event, "status": "cancelled"})
+                return 204, None
+            event = {**events[event_id], **json.loads(body)} if method == "PATCH" else json.loads(body)
+            event["id"] = event_id
+            events[event_id] = event
+            self._record_change(calendar_id, event)
+            return 200, event
+
+    def _record_change(self, calendar_id, event):
+        self.changes.append((len(self.changes), calendar_id, event))
+
+    def _list(self, calendar_id, events, params):
+        max_results = int(params.get("maxResults", 250))
+        if "syncToken" in params:
+            offset = int(params.get("pageToken", 0))
+            items = [event for _, cid, event in self.changes[int(params["syncToken"]):] if cid == calendar_id]
+            page, next_page_token = items[offset:offset + max_results], str(offset + max_results)
+            has_more = offset + max_results < len(items)
+        else:
+            # like Google's, page tokens are cursors rather than offsets, so deleting listed events skips nothing
+            def position(event):
+                sequence = int(event["id"].removeprefix("event"))
+                if params.get("orderBy") == "startTime":
+                    return [datetime.fromisoformat(event["start"]["dateTime"]).timestamp(), sequence]
+                return [sequence]
+
+            items = sorted((event for event in events.values() if _in_window(event, params)), key=position)
+            if params.get("pageToken"):
+                cursor = json.loads(params["pageToken"])
+                items = [event for event in items if position(event) > cursor]
+            page = items[:max_results]
+            next_page_token = page and json.dumps(position(page[-1]))
+            has_more = len(items) > max_results
+        if has_more:
+            return 200, {"items": page, "nextPageToken": next_page_token}
+        return 200, {"items": page, "nextSyncToken": str(len(self.changes))}
+
+
+def _in_window(event, params) -> bool:
+    start, end = (datetime.fromisoformat(event[key]["dateTime"]) for key in ("start", "end"))
+    return ((not params.get("timeMin") or end > datetime.fromisoformat(params["timeMin"])) and
+            (not params.get("timeMax") or start < datetime.fromisoformat(params["timeMax"])))
+
+
+class FakeCalendarHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PATCH(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.command == "POST" and urlparse(self.path).path == BATCH_PATH:
+            boundary = "batch_response"
+            content = self._handle_batch(body, boundary).encode()
+            content_type = f"multipart/mixed; boundary={boundary}"
+            status = 200
+        else:
+            status, response = self.server.dispatch(self.command, self.path, body)
+            content = json.dumps(response).encode() if response is not None else b""
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle_batch(self, body: bytes, boundary: str) -> str:
+        with self.server._lock:
+            self.server.calls["batch"] = self.server.calls.get("batch", 0) + 1
+        message = BytesParser().parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        parts = list()
+        for part in message.get_payload():
+            request_line, serialized = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.split(" ", 2)
+            request = Parser().parsestr(serialized)
+            payload = request.get_payload()
+            status, response = self.server.dispatch(method, path, payload.encode() if payload else b"")
+            content = json.dumps(response) if response is not None else ""
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {part['Content-ID']}\r\n\r\n"
+                         f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{content}\r\n")
+        return "".join(parts) + f"--{boundary}--\r\n"
+
+    def log_message(self, format, *args):
+        pass
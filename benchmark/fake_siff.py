@@ -0,0 +1,147 @@
+"""
+A local stand-in for siff.net, serving synthetic venue and film pages built from the test/inputs templates
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from src.constants import SIFFTheatre, PACIFIC_TIMEZONE, MILLISEC_PER_SEC
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(__file__), "..", "test", "inputs", "movie", "example.html")
+TEMPLATE_SCREENING_REGEX = r"<a class=\"elevent button on\".*?</a>"
+TEMPLATE_SLUG = "/cinema/in-theaters/crossing"
+TEMPLATE_TITLE = "Crossing"
+TEMPLATE_META = "Sweden | 2024 | 106 min. | Levan Akin"
+
+VENUES = {
+    SIFFTheatre.EGYPTIAN: ("SIFF Cinema Egyptian", "805 East Pine Street", "98122"),
+    SIFFTheatre.DOWNTOWN: ("SIFF Cinema Downtown", "2100 6th Avenue", "98121"),
+    SIFFTheatre.UPTOWN: ("SIFF Cinema Uptown", "511 Queen Anne Avenue North", "98109"),
+    SIFFTheatre.FILM_CENTER: ("SIFF Film Center", "167 Republican Street", "98109"),
+}
+
+# real pages are mostly navigation, scripts and footers around the listing
+PAGE_BOILERPLATE = "".join(f'<li class="nav-item"><a href="/nav/{i}">Navigation link {i}</a></li>' for i in range(400))
+PAGE_SCRIPT = "<script>" + "var config = {\"key\": \"value\"};" * 200 + "</script>"
+
+
+class SyntheticFestival:
+    """
+    A deterministic festival: every film has a page, and every (theatre, day) venue page lists a sample of the films,
+    each with several screenings. Venue pages past `listed_days` are empty, as if not yet published
+    """
+
+    def __init__(self, films=300, films_per_page=60, screenings_per_film=4, seed=0, listed_days=None):
+        assert films_per_page <= films
+        with open(TEMPLATE_FILE, "r", encoding="utf-8") as f:
+            self.item_template = f.read()
+        self.films = [{"slug": f"film-{i}", "title": f"Synthetic Film {i}", "year": 1950 + i % 75,
+                       "minutes": 80 + i % 70, "director": f"Director {i}", "country": f"Country {i % 40}"}
+                      for i in range(films)]
+        self.films_per_page = films_per_page
+        self.screenings_per_film = screenings_per_film
+        self.seed = seed
+        self.listed_days = listed_days
+        self.revision = 0  # bump to change every venue page's content
+
+    def venue_page(self, theatre: SIFFTheatre, day: int) -> bytes:
+        if self.listed_days is not None and day >= self.listed_days:
+            return self._page("")
+        rng = random.Random(f"{self.seed}/{theatre}/{day}/{self.revision}")
+        date = datetime.now(PACIFIC_TIMEZONE).replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(day)
+        items = "".join(self._item(film, theatre, date, rng)
+                        for film in rng.sample(self.films, self.films_per_page))
+        return self._page(f'<div class="listing">{items}</div>')
+
+    def film_page(self, slug: str) -> bytes:
+        paragraphs = "".join(f"<p>Paragraph {i} about <em>{slug}</em>, with some <a href='#'>links</a>.</p>"
+                             for i in range(6))
+        return self._page(f'<div class="body-copy">{paragraphs}</div>')
+
+    def count_showings(self, interval_days: int) -> int:
+        listed_days = min(interval_days, self.listed_days) if self.listed_days is not None else interval_days
+        return len(VENUES) * listed_days * self.films_per_page * self.screenings_per_film
+
+    def _item(self, film, theatre, date, rng) -> str:
+        venue, address, zip_code = VENUES[theatre]
+        screenings = list()
+        for start in sorted(rng.sample(range(0, 12 * 60, 15), self.screenings_per_film)):
+            start_time = date + timedelta(minutes=start)
+            end_time = start_time + timedelta(minutes=film["minutes"])
+            data = {"EventName": film["title"],
+                    "Showtime": f"/Date({int(start_time.timestamp() * MILLISEC_PER_SEC)})/",
+                    "ShowtimeEnd": f"/Date({int(end_time.timestamp() * MILLISEC_PER_SEC)})/",
+                    "VenueName": venue, "VenueAddress1": address, "VenueCity": "Seattle", "VenueState": "WA",
+                    "VenueZipCode": zip_code}
+            screenings.append(f"<a class=\"elevent button on\" data-screening='{json.dumps(data)}' "
+                              f"href=\"javascript:;\">{start_time.strftime('%I:%M %p')}</a>")
+        meta = f"{film['country']} | {film['year']} | {film['minutes']} min. | {film['director']}"
+        item = re.sub(TEMPLATE_SCREENING_REGEX, lambda _: "".join(screenings), self.item_template, flags=re.DOTALL)
+        return (item.replace(TEMPLATE_SLUG, f"/cinema/in-theaters/{film['slug']}")
+                .replace(TEMPLATE_TITLE, film["title"])
+                .replace(TEMPLATE_META, meta))
+
+    @staticmethod
+    def _page(content: str) -> bytes:
+        return (f"<!DOCTYPE html><html><head><title>SIFF</title>{PAGE_SCRIPT}</head><body>"
+                f"<nav><ul>{PAGE_BOILERPLATE}</ul></nav><main>{content}</main>"
+                f"<footer><ul>{PAGE_BOILERPLATE}</ul></footer></body></html>").encode()
+
+
+class FakeSIFFServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, festival: SyntheticFestival):
+        super().__init__(("127.0.0.1", 0), FakeSIFFHandler)
+        self.festival = festival
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+
+class FakeSIFFHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like siff.net
+
+    def do_GET(self):
+        self.server.count_request()
+        url = urlparse(self.path)
+        if url.path.startswith("/cinema/cinema-venues/"):
+            theatre = SIFFTheatre(url.path.rsplit("/", 1)[1])
+            content = self.server.festival.venue_page(theatre, int(parse_qs(url.query)["day"][0]))
+        elif url.path.startswith("/cinema/in-theaters/"):
+            content = self.server.festival.film_page(url.path.rsplit("/", 1)[1])
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
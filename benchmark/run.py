@@ -0,0 +1,219 @@
+"""
+Offline benchmarks for the scraper and the calendar updater, run against local stand-ins for siff.net and the
+Google Calendar API. Results are saved as JSON so that they can be compared between commits:
+
+    python -m benchmark.run --output before.json
+    python -m benchmark.run --output after.json --compare before.json
+
+Thread and process modes (see src.siff_scraper.set_parse_processes) are compared the same way:
+
+    python -m benchmark.run --only scrape --output thread.json
+    python -m benchmark.run --only scrape --mode process --output process.json --compare thread.json
+"""
+import argparse
+import cProfile
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from google.oauth2.credentials import Credentials
+
+import src.calendar_client as calendar_client
+import src.siff_calendar_updater as siff_calendar_updater
+import src.siff_scraper as siff_scraper
+from benchmark.fake_calendar import FakeCalendarServer
+from benchmark.fake_siff import FakeSIFFServer, SyntheticFestival
+from src.constants import SIFFTheatre, GoogleCalendar
+from src.util import parse_html_subtrees
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class BenchmarkRunner:
+
+    def __init__(self, args, siff_server: FakeSIFFServer, calendar_server: FakeCalendarServer):
+        self.args = args
+        self.siff_server = siff_server
+        self.calendar_server = calendar_server
+        self.results = dict()
+
+    def measure(self, name, function, setup=None):
+        """
+        Times `repeat` runs of the function, each after calling the (untimed) setup. The last run is profiled if a
+        profile directory was provided
+        """
+        durations, siff_requests, calendar_calls = list(), list(), list()
+        for i in range(self.args.repeat):
+            if setup:
+                setup()
+            requests_before, calls_before = self.siff_server.request_count, dict(self.calendar_server.calls)
+            profiler = cProfile.Profile() if self.args.profile and i == self.args.repeat - 1 else None
+            start = time.perf_counter()
+            if profiler:
+                profiler.runcall(function)
+            else:
+                function()
+            durations.append(time.perf_counter() - start)
+            siff_requests.append(self.siff_server.request_count - requests_before)
+            calendar_calls.append({method: count - calls_before.get(method, 0)
+                                   for method, count in self.calendar_server.calls.items()
+                                   if count != calls_before.get(method, 0)})
+            if profiler:
+                os.makedirs(self.args.profile, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.args.profile, f"{name}.prof"))
+
+        self.results[name] = {"min_seconds": min(durations),
+                              "median_seconds": statistics.median(durations),
+                              "mean_seconds": statistics.mean(durations),
+                              "runs": len(durations),
+                              "siff_requests": siff_requests[-1],
+                              "calendar_calls": calendar_calls[-1]}
+        print(f"{name:<32} median {self.results[name]['median_seconds'] * 1000:10.1f} ms"
+              f"   siff requests {siff_requests[-1]:5}   calendar calls {calendar_calls[-1]}")
+
+    def run_parsing_benchmarks(self):
+        festival = self.siff_server.festival
+        venue_page, film_page = festival.venue_page(SIFFTheatre.EGYPTIAN, 0), festival.film_page("film-0")
+        items = parse_html_subtrees(venue_page, "div", class_="listing").find_all("div", class_="item")
+
+        self.measure("parse_listing", lambda: siff_scraper._parse_listing(venue_page))
+        self.measure("parse_description", lambda: parse_html_subtrees(film_page, "div", class_="body-copy"))
+        self.measure("extract_screenings", lambda: [siff_scraper._extract_screenings(item) for item in items])
+
+    def run_scrape_benchmarks(self):
+        theatre, days = SIFFTheatre.EGYPTIAN, self.args.days
+        self.measure("scrape_showings_cold", lambda: siff_scraper.scrape_showings(theatre, interval_days=days),
+                     setup=_clear_scraper_caches)
+        self.measure("scrape_showings_warm", lambda: siff_scraper.scrape_showings(theatre, interval_days=days))
+
+        def adaptive_scrape():
+            siff_scraper.scrape_showings(theatre, interval_days=days, adaptive=True)
+
+        self.measure("scrape_showings_adaptive", adaptive_scrape, setup=adaptive_scrape)
+
+    def run_update_benchmarks(self):
+        def update_all(force=False, streaming=False, sinks=("google",)):
+            pairs = list(zip(GoogleCalendar, SIFFTheatre))
+            with ThreadPoolExecutor() as executor:
+                futures = [executor.submit(siff_calendar_updater.update_calendar, calendar_id, theatre,
+                                           interval_days=self.args.days, force=force, streaming=streaming, sinks=sinks)
+                           for calendar_id, theatre in pairs]
+                for future in futures:
+                    future.result()
+
+        def reset_calendars():
+            _clear_scraper_caches()
+            self.calendar_server.calendars.clear()
+            siff_calendar_updater._sync_states.clear()
+            for path in os.listdir("."):
+                if os.path.isdir(path):  # sync state and feeds
+                    for file in os.listdir(path):
+                        os.remove(os.path.join(path, file))
+
+        self.measure("update_calendar_cold", update_all, setup=reset_calendars)
+        self.measure("update_calendar_unchanged", update_all)
+        self.measure("update_calendar_forced", lambda: update_all(force=True))
+        self.measure("update_calendar_streaming_cold", lambda: update_all(streaming=True), setup=reset_calendars)
+        self.measure("update_ics_cold", lambda: update_all(sinks=("ics",)), setup=reset_calendars)
+        self.measure("update_ics_forced", lambda: update_all(force=True, sinks=("ics",)))
+
+
+def _clear_scraper_caches():
+    siff_scraper.invalidate_description()
+    siff_scraper._get_page_cache().invalidate()
+    siff_scraper._get_crawl_scheduler().history.invalidate()
+
+
+def _print_comparison(results, baseline):
+    print(f"\nCompared to {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for name, result in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if previous:
+            ratio = result["median_seconds"] / previous["median_seconds"]
+            print(f"{name:<32} {ratio:6.2f}x {'(slower)' if ratio > 1.1 else '(faster)' if ratio < 0.9 else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=300, help="number of films in the synthetic festival")
+    parser.add_argument("--films-per-page", type=int, default=60, help="films listed on each venue page")
+    parser.add_argument("--screenings-per-film", type=int, default=4, help="screenings per film on each page")
+    parser.add_argument("--days", type=int, default=7, help="days of venue pages to scrape")
+    parser.add_argument("--listed-days", type=int, help="days with showings listed, the rest of the pages are empty")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--profile", metavar="DIRECTORY", help="save cProfile output of each benchmark here")
+    parser.add_argument("--output", help="where to save the results (default: benchmark/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="RESULTS", help="print the speedup relative to earlier results")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread",
+                        help="parse pages on the scraping threads, or in a pool of worker processes")
+    parser.add_argument("--only", choices=["parsing", "scrape", "update"], help="only run one group of benchmarks")
+    parser.add_argument("--verbose", action="store_true", help="keep the scraper's and updater's logs")
+    args = parser.parse_args()
+    if args.profile:
+        args.profile = os.path.abspath(args.profile)
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIRECTORY, f"{_get_commit()}.json"))
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    festival = SyntheticFestival(args.films, args.films_per_page, args.screenings_per_film,
+                                 listed_days=args.listed_days)
+    siff_server, calendar_server = FakeSIFFServer(festival), FakeCalendarServer()
+    for server in (siff_server, calendar_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    siff_scraper.SIFF_ROOT = siff_server.url
+    calendar_client._credentials = Credentials(token="benchmark")
+    calendar_client._service = calendar_server.build_service(calendar_client._credentials,
+                                                             calendar_client._build_request)
+    calendar_client.rate_limiter = None  # the stand-in has no quota, and waiting on it isn't what's measured
+
+    runner = BenchmarkRunner(args, siff_server, calendar_server)
+    print(f"Synthetic festival: {args.films} films, {festival.count_showings(args.days)} showings over "
+          f"{args.days} days at {len(SIFFTheatre)} theatres")
+    if args.mode == "process":
+        siff_scraper.set_parse_processes(os.cpu_count())
+    try:
+        with tempfile.TemporaryDirectory() as working_directory:
+            os.chdir(working_directory)  # caches and sync state are written relative to the working directory
+            for group in ("parsing", "scrape", "update"):
+                if args.only in (None, group):
+                    getattr(runner, f"run_{group}_benchmarks")()
+    finally:
+        siff_scraper.set_parse_processes(None)
+
+    results = {"commit": _get_commit(),
+               "timestamp": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "machine": platform.machine(),
+               "parameters": {key: value for key, value in vars(args).items()
+                              if key not in ("output", "compare", "profile", "verbose")},
+               "benchmarks": runner.results}
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            _print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
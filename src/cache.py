@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from src.util import get_logger
+
+logger = get_logger(__name__)
+
+
+class PersistentCache:
+    """
+    A string key-value store backed by a SQLite table, so that cached values survive across runs. Entries expire after
+    `ttl_seconds`, and the least recently stored entries are evicted once there are more than `max_entries`.
+    Safe to share between threads, and between processes using the same file
+    """
+
+    def __init__(self, path: str, table: str, ttl_seconds: float, max_entries: int):
+        assert table.isidentifier()
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                 f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_stored_at ON {table} (stored_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?",
+                                           (key,)).fetchone()
+        if not row:
+            return None
+        value, stored_at = row
+        if time.time() - stored_at > self.ttl_seconds:
+            logger.debug("Cache entry expired: %s - %s", self.table, key)
+            self.invalidate(key)
+            return None
+        return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                                     (key, value, time.time()))
+            self._evict()
+
+    def invalidate(self, key: Optional[str] = None):
+        """
+        Removes the entry for the given key, or every entry if no key is provided
+        """
+        with self._lock:
+            if key is None:
+                self._connection.execute(f"DELETE FROM {self.table}")
+            else:
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _evict(self):
+        self._connection.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+        overflow = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            logger.debug("Evicting %d entries from cache: %s", overflow, self.table)
+            self._connection.execute(f"DELETE FROM {self.table} WHERE key IN "
+                                     f"(SELECT key FROM {self.table} ORDER BY stored_at LIMIT ?)", (overflow,))
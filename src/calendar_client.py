@@ -0,0 +1,151 @@
+import json
+import os.path
+import threading
+from typing import TYPE_CHECKING, Optional, Set
+
+from src import transport
+from src.util import get_logger
+
+# the Google client libraries take a while to import, so they're only imported once the calendar is actually used
+# (e.g., not on a run where no venue page changed)
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import HttpRequest
+
+CREDENTIALS_FILE = 'credentials.json'
+TOKEN_FILE = 'token.json'
+
+# Scopes required by the Google Calendar API
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+CALENDAR_API_HOST = "www.googleapis.com"
+# The Calendar API's default per-user quota. Each call in a batch request counts against it
+CALENDAR_API_QUOTA_PER_MINUTE = 600
+CALENDAR_API_BURST = 50  # a full batch
+# 403 is also returned for rate limiting, but only these reasons are transient, unlike e.g. forbidden (no write access)
+# or quotaExceeded (the daily quota)
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+logger = get_logger(__name__)
+
+_credentials: Optional["Credentials"] = None
+_service = None
+_lock = threading.RLock()  # guards the credentials (including token.json) and the service
+_thread_local = threading.local()
+rate_limiter: Optional[transport.TokenBucket] = transport.TokenBucket(CALENDAR_API_QUOTA_PER_MINUTE / 60,
+                                                                      CALENDAR_API_BURST)
+
+
+def get_credentials() -> "Credentials":
+    """
+    The process-wide credentials. Loading, refreshing and saving them happens under a lock, so concurrent threads
+    never refresh the token or rewrite the token file at the same time
+    """
+    global _credentials
+    with _lock:
+        if _credentials and _credentials.valid:
+            return _credentials
+
+        logger.debug("Retrieving credentials")
+        from google.oauth2.credentials import Credentials
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if not _credentials and os.path.exists(TOKEN_FILE):
+            logger.debug("Found existing token file")
+            _credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+            # If there are no (valid) credentials available, let the user log in.
+
+        if not (_credentials and _credentials.valid):
+            if _credentials and _credentials.expired and _credentials.refresh_token:
+                logger.warning("Refreshing expired token")
+                from google.auth.transport.requests import Request
+                _credentials.refresh(Request())
+            else:
+                logger.critical("New credentials required")
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+                _credentials = flow.run_local_server(port=0)
+
+            # Save the credentials for the next run
+            with open(f"{TOKEN_FILE}.tmp", "w") as token:
+                token.write(_credentials.to_json())
+            os.replace(f"{TOKEN_FILE}.tmp", TOKEN_FILE)
+        return _credentials
+
+
+def _get_thread_http() -> "AuthorizedHttp":
+    """
+    httplib2 transports aren't thread-safe, so each thread gets its own (reused across that thread's requests)
+    """
+    if not hasattr(_thread_local, "http"):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        http = httplib2.Http(timeout=transport.READ_TIMEOUT_SECONDS)  # httplib2 has one timeout, for every operation
+        _thread_local.http = AuthorizedHttp(get_credentials(), http=http)
+    return _thread_local.http
+
+
+def _build_request(_http, *args, **kwargs) -> "HttpRequest":
+    from googleapiclient.http import HttpRequest
+    get_credentials()  # refresh under the lock before the transport would try to refresh on its own
+    return HttpRequest(_get_thread_http(), *args, **kwargs)
+
+
+def get_service():
+    """
+    The process-wide Google Calendar API service, built once. Safe to share between threads, since every request it
+    creates executes on the calling thread's own transport
+    """
+    global _service
+    with _lock:
+        if _service is None:
+            logger.debug("Building Google Calendar API service")
+            from googleapiclient.discovery import build
+            _service = build('calendar', 'v3', credentials=get_credentials(), requestBuilder=_build_request)
+        return _service
+
+
+def is_retryable(outcome) -> bool:
+    """
+    Whether an API request's response or error is transient: rate limiting, a server error, or a connection that
+    failed or timed out
+    """
+    from googleapiclient.errors import HttpError
+    if isinstance(outcome, HttpError):
+        return is_throttled(outcome) or outcome.resp.status in transport.RETRYABLE_STATUS_CODES
+    return isinstance(outcome, OSError)  # includes socket timeouts and connection errors
+
+
+def is_throttled(outcome) -> bool:
+    """
+    Whether an API request's error is rate limiting, rather than a failure of the API
+    """
+    from googleapiclient.errors import HttpError
+    if not isinstance(outcome, HttpError):
+        return False
+    if outcome.resp.status == 403:
+        return bool(_get_error_reasons(outcome) & RATE_LIMIT_REASONS)
+    return outcome.resp.status == transport.THROTTLED_STATUS_CODE
+
+
+def _get_error_reasons(error) -> Set[str]:
+    """
+    :return: the reasons given for an API error, e.g., {"rateLimitExceeded"}
+    """
+    details = getattr(error, "error_details", None)
+    details = list(details) if isinstance(details, list) else list()
+    try:
+        details.extend(json.loads(error.content)["error"]["errors"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    return {detail["reason"] for detail in details if isinstance(detail, dict) and "reason" in detail}
+
+
+def execute(request, cost=1):
+    """
+    Executes an API request (or a batch request of `cost` calls) within the quota, retrying transient errors
+    """
+    return transport.call(CALENDAR_API_HOST, request.execute, is_retryable, is_throttled, rate_limiter=rate_limiter,
+                          cost=cost)
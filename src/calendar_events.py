@@ -0,0 +1,46 @@
+import re
+from datetime import datetime
+from typing import Dict
+
+from src.model import MovieShowing, ShowTime, HashableMovieEvent
+
+MOVIE_TITLE_PREFIX = "[Movie] "
+FORMATTED_YEAR_REGEX = r"\(\d{4}\*?\)"
+TIMEZONE = 'America/Los_Angeles'
+
+
+def extract_movie(calendar_event) -> HashableMovieEvent:
+    """
+    Extract a MovieEvent from the calendar event
+    """
+
+    def extract_formatted_year(year_string: str) -> str:
+        """
+        Extract the formatted year from a string. Some years have an asterisk, so handle accordingly
+        """
+        match = re.search(FORMATTED_YEAR_REGEX, year_string)
+        if match:
+            return match.group()
+
+    formatted_year = extract_formatted_year(calendar_event["summary"])
+    title = calendar_event["summary"][len(MOVIE_TITLE_PREFIX):][:-len(formatted_year)].strip()
+    year = formatted_year.strip("()")
+    showtime = datetime.fromisoformat(calendar_event["start"]["dateTime"])
+    location = calendar_event["location"]
+    return HashableMovieEvent(title=title, year=year, showtime=ShowTime(showtime, None), location=location)
+
+
+def create_event(movie: MovieShowing) -> Dict:
+    return {
+        "summary": f"{MOVIE_TITLE_PREFIX}{movie.title} ({movie.year})",
+        "location": movie.location,
+        "description": f"Director: {movie.director} - {movie.country}\n{movie.description}\n---\n{movie.link}" +
+                       ("\n\n* = year was unspecified, assuming this year" if "*" in movie.year else ""),
+        "start": {"dateTime": movie.showtime.start_time.isoformat(timespec="seconds"),
+                  'timeZone': TIMEZONE},
+        "end": {"dateTime": movie.showtime.end_time.isoformat(timespec="seconds"),
+                'timeZone': TIMEZONE},
+        "visibility": "public",
+        "transparency": "transparent",  # non-blocking on calendar
+        "reminders": {"useDefault": False}  # don't send reminders
+    }
@@ -3,6 +3,10 @@ from enum import StrEnum
 import pytz
 
 
+# any venue on the SIFF website, by its slug in the venue page URL (e.g., a festival venue configured in src.registry)
+VENUE_SLUG_REGEX = r"^[a-z0-9]+(-[a-z0-9]+)*$"
+
+
 # the string value must match the one used in the SIFF website URL
 class SIFFTheatre(StrEnum):
     EGYPTIAN = "siff-cinema-egyptian"
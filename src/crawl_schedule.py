@@ -0,0 +1,50 @@
+import json
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from src.cache import PersistentCache
+
+DAY_SECONDS = 24 * 60 * 60
+# (fewer than this many days out, seconds between fetches of a page that never changes)
+REFETCH_INTERVALS = ((3, 0), (7, DAY_SECONDS), (14, 2 * DAY_SECONDS), (30, 3 * DAY_SECONDS))
+FAR_REFETCH_INTERVAL = 5 * DAY_SECONDS  # must stay below the page cache's TTL, so skipped pages can be reused
+CHANGE_RATE_PRIOR = 0.5  # assumed for a page fetched once, since its first fetch is always a change
+CHANGE_RATE_WEIGHT = 0.3  # of the latest fetch in the moving average
+
+
+@dataclass
+class CrawlHistory:
+    fetched_at: float
+    change_rate: float  # exponential moving average of whether each fetch found the page changed
+
+
+class CrawlScheduler:
+    """
+    Decides which venue pages are worth fetching on this run. Near dates are fetched every run, since showings are
+    added and sell out there, while far dates are only fetched every few days. The interval shrinks the more often a
+    page has changed when it was fetched, down to every run for a page that changes every time.
+    History is kept per theatre and date, so it carries over as a date moves closer
+    """
+
+    def __init__(self, history: PersistentCache):
+        self.history = history
+
+    def get_history(self, key: str) -> Optional[CrawlHistory]:
+        entry = self.history.get(key)
+        return CrawlHistory(**json.loads(entry)) if entry else None
+
+    def is_due(self, key: str, days_out: int) -> bool:
+        history = self.get_history(key)
+        if history is None:
+            return True
+        interval = next((seconds for days, seconds in REFETCH_INTERVALS if days_out < days), FAR_REFETCH_INTERVAL)
+        return time.time() - history.fetched_at >= interval * (1 - history.change_rate)
+
+    def record_fetch(self, key: str, changed: bool):
+        history = self.get_history(key)
+        if history is None:
+            change_rate = CHANGE_RATE_PRIOR
+        else:
+            change_rate = (1 - CHANGE_RATE_WEIGHT) * history.change_rate + CHANGE_RATE_WEIGHT * changed
+        self.history.set(key, json.dumps(asdict(CrawlHistory(fetched_at=time.time(), change_rate=change_rate))))
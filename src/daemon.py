@@ -0,0 +1,151 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from src.constants import SIFFTheatre, GoogleCalendar
+from src.metrics import metrics
+from src.siff_calendar_updater import update_calendars
+from src.util import get_logger
+
+DEFAULT_PORT = 8642
+DEFAULT_INTERVAL_SECONDS = 12 * 60 * 60
+DEFAULT_JITTER_SECONDS = 10 * 60
+
+logger = get_logger(__name__)
+
+
+class UpdateDaemon:
+    """
+    Updates the calendars on a schedule from a single long-running process, instead of a cron job starting a fresh
+    one every time. The Calendar API service, credentials, siff.net session, cache connections and the calendars'
+    sync state are all process-wide, so they stay warm between runs.
+
+    Runs start immediately and then every `interval_seconds`, give or take up to `jitter_seconds` so that requests
+    don't always land at the same minute. A run can also be requested from localhost (see UpdateRequestHandler)
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[GoogleCalendar, SIFFTheatre]], interval_seconds=DEFAULT_INTERVAL_SECONDS,
+                 jitter_seconds=DEFAULT_JITTER_SECONDS, report_paths: Optional[Tuple[str, str]] = None,
+                 **update_options):
+        """
+        :param report_paths: where to write each run's report, as JSON and as a Prometheus textfile
+        :param update_options: passed on to update_calendar
+        """
+        assert 0 <= jitter_seconds < interval_seconds
+        self.pairs = list(pairs)
+        self.interval_seconds = interval_seconds
+        self.jitter_seconds = jitter_seconds
+        self.report_paths = report_paths
+        self.update_options = update_options
+        self.server: Optional[ThreadingHTTPServer] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._force_requested = False
+        self._status = {"running": False, "runs": 0, "next_run_at": time.time(), "last_run": None}
+
+    def start_server(self, port=DEFAULT_PORT) -> ThreadingHTTPServer:
+        """
+        Serves on-demand runs and the daemon's status on localhost, on a background thread
+        """
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), UpdateRequestHandler)
+        self.server.daemon_threads = True
+        self.server.update_daemon = self
+        threading.Thread(target=self.server.serve_forever, name="update-daemon-server", daemon=True).start()
+        logger.info("Listening for update requests on http://127.0.0.1:%d/", self.server.server_address[1])
+        return self.server
+
+    def run_forever(self):
+        force = False
+        while not self._stopped.is_set():
+            self._run(force)
+            force = self._wait_for_next_run()
+
+    def request_run(self, force=False):
+        """
+        Starts a run as soon as the current one (if any) is done
+        :param force: update every calendar, even if none of the theatre's venue pages changed
+        """
+        with self._lock:
+            self._force_requested = self._force_requested or force
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self.server:
+            self.server.shutdown()
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            return dict(self._status)
+
+    def _wait_for_next_run(self) -> bool:
+        """
+        :return: whether the run was requested with force
+        """
+        delay = self.interval_seconds + random.uniform(-self.jitter_seconds, self.jitter_seconds)
+        with self._lock:
+            self._status["next_run_at"] = time.time() + delay
+        self._wake.wait(delay)
+        with self._lock:
+            force, self._force_requested = self._force_requested, False
+            self._wake.clear()
+        return force
+
+    def _run(self, force: bool):
+        with self._lock:
+            self._status["running"] = True
+        metrics.reset()
+        started_at, failures = time.time(), len(self.pairs)
+        try:
+            failures = update_calendars(self.pairs, force=force, **self.update_options)
+        except Exception as e:
+            logger.critical("Scheduled update failed: %s", e)
+        finally:
+            if self.report_paths:
+                metrics.write_report(*self.report_paths)
+            with self._lock:
+                self._status.update(running=False, runs=self._status["runs"] + 1,
+                                    last_run={"started_at": started_at, "duration_seconds": time.time() - started_at,
+                                              "forced": force, "failures": failures})
+
+
+class UpdateRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /refresh (or /refresh?force=1) requests a run, GET /status describes the daemon's runs, and GET /metrics
+    serves the current run's metrics in the Prometheus text format
+    """
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/status":
+            self._respond(200, json.dumps(self.server.update_daemon.get_status()), "application/json")
+        elif path == "/metrics":
+            self._respond(200, metrics.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._respond(404, json.dumps({"error": f"Not found: {path}"}), "application/json")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/refresh":
+            self._respond(404, json.dumps({"error": f"Not found: {url.path}"}), "application/json")
+            return
+        force = parse_qs(url.query).get("force", ["0"])[0].lower() in ("1", "true", "yes")
+        self.server.update_daemon.request_run(force=force)
+        self._respond(202, json.dumps({"requested": True, "force": force}), "application/json")
+
+    def _respond(self, status: int, content: str, content_type: str):
+        body = content.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
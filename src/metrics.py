@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+PROMETHEUS_PREFIX = "siff_calendar"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RunMetrics:
+    """
+    Counters and per-phase wall times collected over a run, shared by every thread. Each value is identified by a name
+    and optional labels (e.g., the theatre or the API method)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = dict()
+        self._timings: Dict[Tuple[str, Labels], float] = dict()
+        self._started_at = time.time()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, phase: str, **labels):
+        """
+        Adds the wall time spent in the block to the phase's total
+        """
+        key = (phase, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._timings[key] = self._timings.get(key, 0) + elapsed
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+            self._started_at = time.time()
+
+    def get(self, name: str, **labels) -> float:
+        """
+        The counter's value summed over every label set that includes the provided labels
+        """
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(value for (counter, key), value in self._counters.items()
+                       if counter == name and wanted.issubset(key))
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {"started_at": self._started_at,
+                    "duration_seconds": time.time() - self._started_at,
+                    "counters": [{"name": name, "labels": dict(labels), "value": value}
+                                 for (name, labels), value in sorted(self._counters.items())],
+                    "phases": [{"phase": phase, "labels": dict(labels), "seconds": seconds}
+                               for (phase, labels), seconds in sorted(self._timings.items())]}
+
+    def to_prometheus(self) -> str:
+        report = self.to_dict()
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_run_duration_seconds gauge",
+                 f"{PROMETHEUS_PREFIX}_run_duration_seconds {report['duration_seconds']:.3f}",
+                 f"# TYPE {PROMETHEUS_PREFIX}_run_timestamp_seconds gauge",
+                 f"{PROMETHEUS_PREFIX}_run_timestamp_seconds {report['started_at']:.0f}",
+                 f"# TYPE {PROMETHEUS_PREFIX}_phase_seconds gauge"]
+        lines.extend(f"{PROMETHEUS_PREFIX}_phase_seconds{_format_labels({'phase': p['phase'], **p['labels']})} "
+                     f"{p['seconds']:.3f}" for p in report["phases"])
+        for name in dict.fromkeys(counter["name"] for counter in report["counters"]):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            lines.extend(f"{PROMETHEUS_PREFIX}_{name}_total{_format_labels(c['labels'])} {c['value']:g}"
+                         for c in report["counters"] if c["name"] == name)
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, json_path: str, prometheus_path: str):
+        """
+        Writes the run report as JSON and as a Prometheus textfile. Both are replaced atomically, so collectors never
+        read a partial file
+        """
+        for path, content in ((json_path, json.dumps(self.to_dict(), indent=2)),
+                              (prometheus_path, self.to_prometheus())):
+            with open(f"{path}.tmp", "w") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+# the metrics of the current run
+metrics = RunMetrics()
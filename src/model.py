@@ -1,35 +1,41 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from datetime import datetime
+from typing import Dict
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ShowTime:
     start_time: datetime
     end_time: datetime
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class HashableMovieEvent:
     title: str
     year: str
     location: str
     showtime: ShowTime
+    # computed once at construction, since events are hashed and compared repeatedly when diffing calendars
+    identity_key: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "identity_key", self.__make_id_string())
 
     def __make_id_string(self):
         stripped_datetime = self.showtime.start_time.replace(tzinfo=None)
         return f"{self.title} {self.year} {stripped_datetime.isoformat(timespec='seconds')} {self.location}"
 
     def __eq__(self, other):
-        return other and self.__make_id_string() == other.__make_id_string()
+        return isinstance(other, HashableMovieEvent) and self.identity_key == other.identity_key
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(self.__make_id_string())
+        return hash(self.identity_key)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class MovieShowing(HashableMovieEvent):
     title: str
     director: str
@@ -41,6 +47,17 @@ class MovieShowing(HashableMovieEvent):
     duration_minutes: int
     showtime: ShowTime
 
-    __hash__ = HashableMovieEvent.__hash__
-    __eq__ = HashableMovieEvent.__eq__
-    __ne__ = HashableMovieEvent.__ne__
+    def to_record(self) -> Dict:
+        """
+        A JSON-serializable representation of the showing
+        """
+        record = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        record["showtime"] = {"start_time": self.showtime.start_time.isoformat(),
+                              "end_time": self.showtime.end_time.isoformat()}
+        return record
+
+    @classmethod
+    def from_record(cls, record: Dict) -> "MovieShowing":
+        showtime = ShowTime(start_time=datetime.fromisoformat(record["showtime"]["start_time"]),
+                            end_time=datetime.fromisoformat(record["showtime"]["end_time"]))
+        return cls(**{**record, "showtime": showtime})
@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+from datetime import datetime, date
+from typing import Dict, Iterable, List, Set
+
+from src.calendar_events import create_event, extract_movie
+from src.constants import PACIFIC_TIMEZONE
+from src.model import MovieShowing
+
+# fields of an existing event that are kept up to date with the scraped showing. The rest of the event (title, year,
+# start time and location) is its identity, so a change there is a different showing
+PATCHABLE_FIELDS = ("summary", "description", "end", "reminders")
+
+
+@dataclass
+class ReconciliationPlan:
+    inserts: List[Dict] = field(default_factory=list)  # new event bodies
+    patches: Dict[str, Dict] = field(default_factory=dict)  # event ID -> only the fields that changed
+    deletes: Dict[str, Dict] = field(default_factory=dict)  # event ID -> event
+
+    def __len__(self):
+        return len(self.inserts) + len(self.patches) + len(self.deletes)
+
+    def extend(self, other: "ReconciliationPlan"):
+        self.inserts.extend(other.inserts)
+        self.patches.update(other.patches)
+        self.deletes.update(other.deletes)
+
+
+class ScrapedShowings:
+    """
+    The showings seen by an update so far, which decide what a sink removes once every showing has been seen: only
+    future showings on a scraped date that are no longer listed. Other dates may just not have been scraped this time,
+    and venue pages may stop listing screenings that have already started
+    """
+
+    def __init__(self):
+        self._keys: Set[str] = set()
+        self._dates: Set[date] = set()
+
+    def add(self, key: str, start: datetime) -> bool:
+        """
+        :param key: identifies the showing, e.g., its identity key
+        :return: whether the showing wasn't seen before
+        """
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._dates.add(start.astimezone(PACIFIC_TIMEZONE).date())
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def is_vanished(self, key: str, start: datetime, now: datetime) -> bool:
+        return key not in self._keys and start > now and start.astimezone(PACIFIC_TIMEZONE).date() in self._dates
+
+
+class Reconciler:
+    """
+    Computes the writes that bring one listing of a calendar in line with the scraped showings, in a single pass:
+    - inserts for showings missing from the calendar
+    - patches of only the changed fields (e.g., runtime or description, and any reminders the API added)
+    - deletions of duplicate events, and of future events on scraped dates that are no longer showing
+
+    Showings can be reconciled in chunks as they're scraped, but deletions are only planned once all of them have
+    been seen (see finish)
+    """
+
+    def __init__(self, existing_events: Iterable[Dict]):
+        self._events_by_key: Dict[str, Dict] = dict()
+        self._duplicates: Dict[str, Dict] = dict()
+        for event in existing_events:
+            key = extract_movie(event).identity_key
+            if key in self._events_by_key:
+                self._duplicates[event['id']] = event
+            else:
+                self._events_by_key[key] = event
+        self._scraped = ScrapedShowings()
+
+    def reconcile(self, showings: Iterable[MovieShowing]) -> ReconciliationPlan:
+        """
+        :return: the inserts and patches for the given showings
+        """
+        plan = ReconciliationPlan()
+        for showing in showings:
+            if not self._scraped.add(showing.identity_key, showing.showtime.start_time):
+                continue
+
+            desired = create_event(showing)
+            event = self._events_by_key.get(showing.identity_key)
+            if event is None:
+                plan.inserts.append(desired)
+            else:
+                changes = _diff_event(event, desired)
+                if changes:
+                    plan.patches[event['id']] = changes
+        return plan
+
+    def finish(self, now: datetime = None) -> ReconciliationPlan:
+        """
+        :param now: only events starting after this time are deleted when they vanish from the listings, since venue
+                    pages may stop listing screenings that have already started
+        :return: the deletions, and reminder fixes for events that weren't scraped but are kept
+        """
+        now = now or datetime.now(PACIFIC_TIMEZONE)
+        plan = ReconciliationPlan(deletes=dict(self._duplicates))
+        for key, event in self._events_by_key.items():
+            if key in self._scraped:
+                continue
+            if self._scraped.is_vanished(key, datetime.fromisoformat(event['start']['dateTime']), now):
+                plan.deletes[event['id']] = event
+            elif _has_reminders(event):
+                plan.patches[event['id']] = {"reminders": {"useDefault": False}}
+        return plan
+
+    def plan(self, showings: Iterable[MovieShowing]) -> ReconciliationPlan:
+        """
+        :return: the complete plan for all the scraped showings
+        """
+        plan = self.reconcile(showings)
+        plan.extend(self.finish())
+        return plan
+
+
+def _has_reminders(event: Dict) -> bool:
+    return bool(event.get('reminders', dict()).get("overrides", list()))
+
+
+def _diff_event(event: Dict, desired: Dict) -> Dict:
+    changes = dict()
+    for name in PATCHABLE_FIELDS:
+        if name == "reminders":
+            changed = _has_reminders(event)
+        elif name == "end":
+            # compare instants, since the API may return the time with a different UTC offset than it was written with
+            end, desired_end = event.get('end', dict()).get('dateTime'), desired['end']['dateTime']
+            changed = not end or datetime.fromisoformat(end) != datetime.fromisoformat(desired_end)
+        else:
+            changed = event.get(name) != desired[name]
+        if changed:
+            changes[name] = desired[name]
+    return changes
@@ -0,0 +1,56 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from src.constants import SIFFTheatre, GoogleCalendar, VENUE_SLUG_REGEX
+from src.util import get_logger
+
+CALENDARS_FILE = 'calendars.json'
+CALENDAR_NAME_REGEX = r"^[A-Za-z0-9_-]+$"  # names are used in state file names and metric labels
+
+logger = get_logger(__name__)
+
+_calendar_names: Dict[str, str] = dict()  # calendar ID -> name, for calendars configured outside of GoogleCalendar
+
+
+def load_pairs(path: str = CALENDARS_FILE) -> List[Tuple[str, str]]:
+    """
+    Loads the calendars to update from a config file listing each one's ID, the venue it shows and a name for logs and
+    state files, e.g. {"calendars": [{"name": "SIFF_CINEMA_UPTOWN", "calendar_id": "...@group.calendar.google.com",
+    "theatre": "siff-cinema-uptown"}]}. Venues are siff.net venue slugs, so they needn't be one of the SIFFTheatres
+    (e.g., a festival venue). Without a config file, each GoogleCalendar is paired with its SIFFTheatre
+    :return: the (calendar ID, venue) pairs
+    """
+    if not os.path.exists(path):
+        return list(zip(GoogleCalendar, SIFFTheatre))
+
+    with open(path, "r") as f:
+        config = json.load(f)
+    pairs, names = list(), dict()
+    for entry in config["calendars"]:
+        calendar_id, theatre = entry["calendar_id"], entry["theatre"]
+        name = entry.get("name") or _get_enum_name(calendar_id) or theatre.upper().replace("-", "_")
+        if not re.match(VENUE_SLUG_REGEX, theatre):
+            raise ValueError(f"Invalid venue in {path}: {theatre}")
+        if not re.match(CALENDAR_NAME_REGEX, name):
+            raise ValueError(f"Invalid calendar name in {path}: {name}")
+        if calendar_id in names or name in names.values():
+            raise ValueError(f"Calendar configured twice in {path}: {name}")
+        names[calendar_id] = name
+        pairs.append((calendar_id, theatre))
+
+    _calendar_names.update(names)
+    logger.info("Loaded %d calendars from %s", len(pairs), path)
+    return pairs
+
+
+def get_configured_name(calendar_id: str) -> Optional[str]:
+    return _calendar_names.get(calendar_id)
+
+
+def _get_enum_name(calendar_id: str) -> Optional[str]:
+    try:
+        return GoogleCalendar(calendar_id).name
+    except ValueError:
+        return None
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.constants import SIFFTheatre, GoogleCalendar
+from src.metrics import metrics
+from src.util import get_logger, get_calendar_name
+
+LEASE_DIRECTORY = 'leases'
+LEASE_SECONDS = 2 * 60  # renewed every third of this while the calendar is updated, so only a dead worker's expire
+DONE_SECONDS = 60 * 60  # a calendar updated this recently was updated in the current round
+POLL_SECONDS = 10
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class Lease:
+    key: str
+    generation: int
+    token: str
+
+
+class LeaseStore:
+    """
+    Coordinates the workers updating the same calendars, through files in a directory they share: worker processes on
+    one host, or hosts with the directory on a shared filesystem.
+
+    A worker only updates a calendar while it holds its lease, and marks the calendar done for the round afterwards.
+    Each lease file is a generation of the calendar's lease, created exclusively (a hard link to a complete file), so
+    of the workers taking over an expired lease only the one that creates the next generation holds it
+    """
+
+    def __init__(self, directory=LEASE_DIRECTORY, owner: Optional[str] = None, lease_seconds=LEASE_SECONDS,
+                 done_seconds=DONE_SECONDS):
+        self.directory = directory
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.done_seconds = done_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self, key: str) -> Optional[Lease]:
+        """
+        :return: the lease, unless another worker holds it
+        """
+        generation, current = self._get_current(key)
+        if current and current["expires_at"] > time.time():
+            return None
+        lease = Lease(key, generation + 1, uuid.uuid4().hex)
+        path = self._get_lease_path(lease.key, lease.generation)
+        if not self._create(path, self._to_record(lease)):
+            return None
+        if self._get_current(key)[0] != lease.generation:
+            # this worker's view was outdated, and another worker already took over a later generation
+            self._remove(path)
+            return None
+        for older in self._get_generations(key):
+            if older < lease.generation:
+                self._remove(self._get_lease_path(key, older))
+        if current and current["expires_at"]:  # rather than released
+            logger.warning("Took over the expired lease on %s from %s", key, current["owner"])
+        return lease
+
+    def renew(self, lease: Lease) -> bool:
+        """
+        :return: whether the lease was still held, and is now extended
+        """
+        if not self._is_current(lease):
+            return False
+        self._replace(self._get_lease_path(lease.key, lease.generation), self._to_record(lease))
+        return True
+
+    def release(self, lease: Lease):
+        if self._is_current(lease):
+            self._replace(self._get_lease_path(lease.key, lease.generation), self._to_record(lease, expires_at=0))
+
+    @contextmanager
+    def hold(self, lease: Lease):
+        """
+        Keeps renewing the lease on a background thread until the block exits, then releases it
+        """
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self.lease_seconds / 3):
+                if not self.renew(lease):
+                    logger.error("Lost the lease on %s", lease.key)
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f"lease-{lease.key}", daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            stopped.set()
+            thread.join()
+            self.release(lease)
+
+    def is_done(self, key: str) -> bool:
+        record = _read(os.path.join(self.directory, f"{key}.done"))
+        return bool(record) and record["completed_at"] > time.time() - self.done_seconds
+
+    def mark_done(self, key: str):
+        self._replace(os.path.join(self.directory, f"{key}.done"), {"owner": self.owner, "completed_at": time.time()})
+
+    def _get_lease_path(self, key: str, generation: int) -> str:
+        return os.path.join(self.directory, f"{key}.{generation}.lease")
+
+    def _get_generations(self, key: str) -> List[int]:
+        pattern = re.compile(rf"^{re.escape(key)}\.(\d+)\.lease$")
+        return [int(match.group(1)) for match in map(pattern.match, os.listdir(self.directory)) if match]
+
+    def _get_current(self, key: str) -> Tuple[int, Optional[Dict]]:
+        """
+        :return: the latest generation of the lease (0 if there is none yet), and its record
+        """
+        generation = max(self._get_generations(key), default=0)
+        return (generation, _read(self._get_lease_path(key, generation))) if generation else (0, None)
+
+    def _is_current(self, lease: Lease) -> bool:
+        generation, current = self._get_current(lease.key)
+        return generation == lease.generation and bool(current) and current["token"] == lease.token
+
+    def _to_record(self, lease: Lease, expires_at: Optional[float] = None) -> Dict:
+        expires_at = time.time() + self.lease_seconds if expires_at is None else expires_at
+        return {"owner": self.owner, "token": lease.token, "expires_at": expires_at}
+
+    @staticmethod
+    def _create(path: str, record: Dict) -> bool:
+        """
+        :return: whether the file was created, rather than already existing
+        """
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(record, f)
+        try:
+            os.link(temporary, path)  # atomic and exclusive, even on NFS
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temporary)
+
+    @staticmethod
+    def _replace(path: str, record: Dict):
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(record, f)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _read(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+    leases: LeaseStore
+
+    def __contains__(self, calendar_id: str) -> bool:
+        return get_shard_index(calendar_id, self.count) == self.index
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    :param value: e.g., "0/3" for the first of three shards
+    :return: the shard's index and the number of shards
+    """
+    match = re.match(r"^(\d+)/(\d+)$", value)
+    if not match or not int(match.group(1)) < int(match.group(2)):
+        raise ValueError(f"Invalid shard: {value} (expected i/n, with 0 <= i < n)")
+    return int(match.group(1)), int(match.group(2))
+
+
+def get_shard_index(calendar_id: str, count: int) -> int:
+    # a stable hash, so every worker assigns the calendars the same way
+    return int(hashlib.sha256(calendar_id.encode()).hexdigest(), 16) % count
+
+
+def update_shard(pairs: Iterable[Tuple[GoogleCalendar, SIFFTheatre]], shard: Shard, **update_options) -> int:
+    """
+    Updates the calendars in this worker's shard, then helps with the rest: any calendar that no worker holds the lease
+    of is taken over, including those of a worker that died mid-update once its lease expires. Returns once every
+    calendar was updated in this round, by this worker or another. A calendar that fails to update still counts as
+    done, like it does in update_calendars, so it's retried on the next round rather than by every worker in turn
+    :param update_options: passed on to update_calendar
+    :return: the number of calendars this worker failed to update
+    """
+    pending, failures = list(pairs), 0
+    with ThreadPoolExecutor() as executor:
+        while True:
+            pending = [pair for pair in pending if not shard.leases.is_done(get_calendar_name(pair[0]))]
+            if not pending:
+                return failures
+            claims = list(_claim(shard, [pair for pair in pending if pair[0] in shard]))
+            if not claims:
+                claims = list(_claim(shard, pending))
+            if not claims:
+                logger.info("Waiting on %d calendars leased by other workers", len(pending))
+                time.sleep(POLL_SECONDS)
+                continue
+
+            futures = [executor.submit(_update_leased, shard.leases, lease, calendar_id, theatre, update_options)
+                       for (calendar_id, theatre), lease in claims]
+            failures += sum(not future.result() for future in futures)
+
+
+def _claim(shard: Shard, pairs: List[Tuple[GoogleCalendar, SIFFTheatre]]) -> Iterator[Tuple[Tuple, Lease]]:
+    for pair in pairs:
+        key = get_calendar_name(pair[0])
+        lease = shard.leases.try_acquire(key)
+        if lease and shard.leases.is_done(key):
+            # another worker updated the calendar (and released its lease) since it was found pending
+            shard.leases.release(lease)
+        elif lease:
+            metrics.increment("calendar_leases", calendar=lease.key, shard="own" if pair[0] in shard else "other")
+            yield pair, lease
+
+
+def _update_leased(leases: LeaseStore, lease: Lease, calendar_id: GoogleCalendar, theatre: SIFFTheatre,
+                   update_options: Dict) -> bool:
+    """
+    :return: whether the calendar was updated
+    """
+    from src.siff_calendar_updater import update_calendar  # imported here, since the updater delegates to this module
+    updated = False
+    with leases.hold(lease):
+        try:
+            update_calendar(calendar_id, theatre, **update_options)
+            updated = True
+        except Exception as e:
+            metrics.increment("calendar_update_failures", calendar=get_calendar_name(calendar_id))
+            logger.critical("An error occurred: %s", e)
+        leases.mark_done(lease.key)
+    return updated
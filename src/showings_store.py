@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+from src.constants import SIFFTheatre, PACIFIC_TIMEZONE
+from src.model import MovieShowing
+from src.reconciler import ScrapedShowings
+from src.util import get_logger
+
+SHOWINGS_DATABASE = "showings.sqlite3"  # kept apart from the caches, which can be deleted at any time
+DEFAULT_PORT = 8643
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+logger = get_logger(__name__)
+
+_stores: Dict[str, "ShowingsStore"] = dict()
+_stores_lock = threading.Lock()
+
+
+class ShowingsStore:
+    """
+    Every showing scraped from the theatres, kept up to date by each update (see src.sinks.ShowingsStoreSink) and
+    indexed by film, by venue and by start time, so that questions like "when is this film playing this month" are
+    answered locally rather than by listing and parsing every calendar.
+    Safe to share between threads, and between processes using the same file
+    """
+
+    def __init__(self, path: str = SHOWINGS_DATABASE, read_only=False):
+        self._lock = threading.Lock()
+        if read_only:
+            self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+            return
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")  # lookups don't block the updater
+        self._connection.execute("CREATE TABLE IF NOT EXISTS showings "
+                                 "(identity_key TEXT PRIMARY KEY, title TEXT NOT NULL COLLATE NOCASE, "
+                                 "year TEXT NOT NULL, theatre TEXT NOT NULL, start_time REAL NOT NULL, "
+                                 "record TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS showings_film ON showings (title, year, start_time)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS showings_theatre ON showings (theatre, start_time)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS showings_start_time ON showings (start_time)")
+
+    def upsert(self, theatre: SIFFTheatre, showings: Iterable[MovieShowing]) -> int:
+        """
+        :return: how many showings were added or changed. Unchanged showings aren't rewritten
+        """
+        rows = [(s.identity_key, s.title, s.year, theatre, s.showtime.start_time.timestamp(),
+                 json.dumps(s.to_record()), time.time()) for s in showings]
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT INTO showings (identity_key, title, year, theatre, start_time, record, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (identity_key) DO UPDATE SET "
+                "title = excluded.title, year = excluded.year, theatre = excluded.theatre, "
+                "start_time = excluded.start_time, record = excluded.record, updated_at = excluded.updated_at "
+                "WHERE showings.record != excluded.record OR showings.theatre != excluded.theatre", rows)
+            return self._connection.total_changes - before
+
+    def remove_missing(self, theatre: SIFFTheatre, scraped: ScrapedShowings, now: Optional[datetime] = None) -> int:
+        """
+        Removes the theatre's showings that vanished from the scraped dates, see ScrapedShowings
+        :return: how many showings were removed
+        """
+        now = now or datetime.now(PACIFIC_TIMEZONE)
+        with self._lock:
+            stored = self._connection.execute("SELECT identity_key, start_time FROM showings "
+                                              "WHERE theatre = ? AND start_time > ?", (theatre, now.timestamp()))
+            vanished = [(key,) for key, start_time in stored.fetchall()
+                        if scraped.is_vanished(key, datetime.fromtimestamp(start_time, timezone.utc), now)]
+            self._connection.executemany("DELETE FROM showings WHERE identity_key = ?", vanished)
+        return len(vanished)
+
+    def query(self, title: Optional[str] = None, year: Optional[str] = None, theatre: Optional[SIFFTheatre] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None,
+              limit=DEFAULT_LIMIT) -> List[Dict]:
+        """
+        :param title: the film's title (case-insensitive)
+        :param start: only showings starting at or after this time
+        :param end: only showings starting before this time
+        :return: the matching showings' records (see MovieShowing.to_record) with their theatre, by start time
+        """
+        conditions, parameters = list(), list()
+        for column, value in (("title = ?", title), ("year = ?", year), ("theatre = ?", theatre),
+                              ("start_time >= ?", start and start.timestamp()),
+                              ("start_time < ?", end and end.timestamp())):
+            if value is not None:
+                conditions.append(column)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(f"SELECT theatre, record FROM showings {where}"
+                                            f"ORDER BY start_time LIMIT ?", (*parameters, limit)).fetchall()
+        return [{**json.loads(record), "theatre": theatre} for theatre, record in rows]
+
+    def count(self, theatre: Optional[SIFFTheatre] = None) -> int:
+        with self._lock:
+            if theatre is None:
+                return self._connection.execute("SELECT COUNT(*) FROM showings").fetchone()[0]
+            return self._connection.execute("SELECT COUNT(*) FROM showings WHERE theatre = ?",
+                                            (theatre,)).fetchone()[0]
+
+
+def get_store(path: str = SHOWINGS_DATABASE) -> ShowingsStore:
+    """
+    The process-wide store for the given file
+    """
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ShowingsStore(path)
+        return _stores[path]
+
+
+def serve_showings(path: str = SHOWINGS_DATABASE, port=DEFAULT_PORT):
+    """
+    Serves lookups of the stored showings on localhost until interrupted, see ShowingsRequestHandler
+    :raises FileNotFoundError: if no showings were stored yet
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No showings stored in {path} yet, update the calendars with the store sink first")
+    server = ThreadingHTTPServer(("127.0.0.1", port), ShowingsRequestHandler)
+    server.daemon_threads = True
+    server.store = ShowingsStore(path, read_only=True)
+    logger.info("Serving showings on http://127.0.0.1:%d/showings", server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class ShowingsRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /showings looks up the stored showings, e.g. /showings?title=Crossing&from=2024-08-01&to=2024-08-31. Filters
+    are title, year, theatre (a venue slug), from and to (dates, inclusive, or ISO datetimes), and limit
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/showings":
+            self._respond(404, {"error": f"Not found: {url.path}"})
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            start = _parse_time(query["from"]) if "from" in query else None
+            end = _parse_time(query["to"], end_of_day=True) if "to" in query else None
+            limit = int(query.get("limit", DEFAULT_LIMIT))
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit} (expected at least 1)")
+            limit = min(limit, MAX_LIMIT)
+        except ValueError as e:
+            self._respond(400, {"error": str(e)})
+            return
+        showings = self.server.store.query(title=query.get("title"), year=query.get("year"),
+                                           theatre=query.get("theatre"), start=start, end=end, limit=limit)
+        self._respond(200, {"showings": showings})
+
+    def _respond(self, status: int, content: Dict):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+def _parse_time(value: str, end_of_day=False) -> datetime:
+    """
+    :param value: a date (in Pacific time) or an ISO datetime
+    :param end_of_day: include the whole of a date, rather than starting at it
+    """
+    if len(value) == len("YYYY-MM-DD"):
+        day = date.fromisoformat(value) + timedelta(days=1 if end_of_day else 0)
+        return PACIFIC_TIMEZONE.localize(datetime.combine(day, datetime.min.time()))
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else PACIFIC_TIMEZONE.localize(parsed)
@@ -1,180 +1,580 @@
+import itertools
+import json
 import os.path
-import re
-from datetime import datetime
-from typing import Dict
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-from src.constants import SIFFTheatre, GoogleCalendar
-from src.model import MovieShowing, ShowTime, HashableMovieEvent
-from src.siff_scraper import scrape_showings
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from googleapiclient.errors import HttpError
+
+from src import transport
+from src.calendar_client import get_service, execute, is_retryable
+from src.calendar_events import extract_movie
+from src.constants import SIFFTheatre, GoogleCalendar, PACIFIC_TIMEZONE
+from src.metrics import metrics
+from src.model import MovieShowing
+from src.reconciler import ReconciliationPlan
+from src.siff_scraper import scrape_theatre, iter_showings, invalidate_venue_pages
 from src.util import get_logger, get_calendar_name
 
-CREDENTIALS_FILE = 'credentials.json'
-TOKEN_FILE = 'token.json'
-MOVIE_TITLE_PREFIX = "[Movie] "
-FORMATTED_YEAR_REGEX = r"\(\d{4}\*?\)"
+if TYPE_CHECKING:
+    from src.sharding import Shard
+    from src.sinks import ShowingSink
 
-# Scopes required by the Google Calendar API
-SCOPES = ['https://www.googleapis.com/auth/calendar']
+SYNC_STATE_DIRECTORY = 'sync_state'
+
+# Partial responses - only request the event fields the updater actually reads
+EVENT_FIELDS = "id,status,summary,description,location,start/dateTime,end/dateTime,reminders"
+LIST_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+INSERT_FIELDS = "id,htmlLink"
+
+PAGE_SIZE = 2500  # the most events().list returns per page
+
+# The Calendar API documents 50 calls per batch request as the practical maximum
+BATCH_SIZE = 50
+MAX_BATCH_ATTEMPTS = 4
+
+# days of scraped showings the scraper may get ahead of the calendar writes when streaming
+STREAM_QUEUE_SIZE = 2
 
 logger = get_logger(__name__)
 
+# sync state path -> (sync token, events) as last loaded or saved, so a long-running process only reads it once
+_sync_states: Dict[str, Tuple[Optional[str], Dict[str, Dict]]] = dict()
+
 
-def _get_credentials() -> Credentials:
-    logger.debug("Retrieving credentials")
-    credentials = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(TOKEN_FILE):
-        logger.debug("Found existing token file")
-        credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        # If there are no (valid) credentials available, let the user log in.
-
-    if not (credentials and credentials.valid):
-        if credentials and credentials.expired and credentials.refresh_token:
-            logger.warning("Refreshing expired token")
-            credentials.refresh(Request())
+def _execute_batch(service, requests: Dict[str, object], **labels) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+    """
+    Executes the given API requests through the batch endpoint, in chunks of BATCH_SIZE calls
+    :param service: the Google Calendar API service
+    :param requests: a mapping of a caller-chosen key (unique per request) to an unexecuted API request
+    :param labels: labels for the API call metrics (e.g., the calendar)
+    :return: the responses and the errors, each keyed the same way as the provided requests. Only sub-requests that
+             failed with a retryable error are retried, with exponential backoff between attempts. Batch requests
+             that fail as a whole are retried by the transport, see src.calendar_client.execute
+    """
+    responses, errors, pending = dict(), dict(), dict(requests)
+
+    def callback(request_id, response, exception):
+        if exception:
+            errors[request_id] = exception
         else:
-            logger.critical("New credentials required")
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-            credentials = flow.run_local_server(port=0)
-
-        # Save the credentials for the next run
-        with open(TOKEN_FILE, "w") as token:
-            token.write(credentials.to_json())
-    return credentials
-
-
-def _extract_movie(calendar_event) -> HashableMovieEvent:
-    """
-    Extract a MovieEvent from the calendar event
-    """
-
-    def extract_formatted_year(year_string: str) -> str:
-        """
-        Extract the formatted year from a string. Some years have an asterisk, so handle accordingly
-        """
-        match = re.search(FORMATTED_YEAR_REGEX, year_string)
-        if match:
-            return match.group()
-
-    formatted_year = extract_formatted_year(calendar_event["summary"])
-    title = calendar_event["summary"][len(MOVIE_TITLE_PREFIX):][:-len(formatted_year)].strip()
-    year = formatted_year.strip("()")
-    showtime = datetime.fromisoformat(calendar_event["start"]["dateTime"])
-    location = calendar_event["location"]
-    return HashableMovieEvent(title=title, year=year, showtime=ShowTime(showtime, None), location=location)
-
-
-def _create_event(movie: MovieShowing) -> Dict:
-    return {
-        "summary": f"{MOVIE_TITLE_PREFIX}{movie.title} ({movie.year})",
-        "location": movie.location,
-        "description": f"Director: {movie.director} - {movie.country}\n{movie.description}\n---\n{movie.link}" +
-                       ("\n\n* = year was unspecified, assuming this year" if "*" in movie.year else ""),
-        "start": {"dateTime": movie.showtime.start_time.isoformat(timespec="seconds"),
-                  'timeZone': 'America/Los_Angeles'},
-        "end": {"dateTime": movie.showtime.end_time.isoformat(timespec="seconds"),
-                'timeZone': 'America/Los_Angeles'},
-        "visibility": "public",
-        "transparency": "transparent",  # non-blocking on calendar
-        "reminders": {"useDefault": False}  # don't send reminders
-    }
-
-
-def _list_events(service, calendar_id: GoogleCalendar) -> list:
-    events_list, page_token = list(), None
-    while True:
-        logger.debug(f"Executing Google API listEvents query with token: {page_token}")
-        events_result = service.events().list(
+            responses[request_id] = response
+            errors.pop(request_id, None)
+            metrics.increment("calendar_writes", operation=requests[request_id].methodId.rsplit(".", 1)[-1], **labels)
+
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        if attempt:
+            logger.warning("Retrying %d failed batch calls (attempt %d/%d)", len(pending), attempt + 1, MAX_BATCH_ATTEMPTS)
+            time.sleep(transport.get_backoff_seconds(attempt))
+        keys = list(pending)
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch, chunk = service.new_batch_http_request(callback=callback), keys[i:i + BATCH_SIZE]
+            for key in chunk:
+                batch.add(pending[key], request_id=key)
+                metrics.increment("calendar_api_calls", method=pending[key].methodId, **labels)
+            logger.debug("Executing Google API batch of %d calls", len(chunk))
+            metrics.increment("calendar_api_calls", method="batch", **labels)
+            execute(batch, cost=len(chunk))
+        pending = {key: pending[key] for key, error in errors.items() if is_retryable(error)}
+        if not pending:
+            break
+
+    for key, error in errors.items():
+        logger.error("Batch call %s failed: %s", key, error)
+    return responses, errors
+
+
+def iter_event_pages(service, calendar_id: GoogleCalendar, page_token: Optional[str] = None,
+                     **list_params) -> Iterator[Tuple[Optional[str], Dict]]:
+    """
+    Pages through events().list with the given parameters, fetching the next page on a background thread while the
+    caller works through the current one. At most two pages are held at once, however many events are listed
+    :param page_token: the page to start from, to resume an earlier listing
+    :return: each page's token (which lists it again) and the page
+    """
+    calendar_name = get_calendar_name(calendar_id)
+
+    def fetch(token: Optional[str]) -> Dict:
+        logger.debug("Executing Google API listEvents query with token: %s", token)
+        metrics.increment("calendar_api_calls", method="calendar.events.list", calendar=calendar_name)
+        return execute(service.events().list(
             calendarId=calendar_id,
-            pageToken=page_token,
-            maxResults=2500,  # Maximum allowed per request
+            pageToken=token,
+            maxResults=PAGE_SIZE,
             singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        events = events_result.get('items', [])
-        events_list.extend(events)
+            fields=LIST_FIELDS,
+            **list_params
+        ))
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"list-{calendar_name}") as executor:
+        next_page = executor.submit(fetch, page_token)
+        while next_page:
+            page = next_page.result()
+            next_page_token = page.get('nextPageToken')
+            next_page = executor.submit(fetch, next_page_token) if next_page_token else None
+            yield page_token, page
+            page_token = next_page_token
+
+
+def _fetch_event_pages(service, calendar_id: GoogleCalendar, **list_params) -> Tuple[List[Dict], Optional[str]]:
+    """
+    :return: the events from every page of the listing and the sync token returned with the last page (if any)
+    """
+    events_list, sync_token = list(), None
+    for _, page in iter_event_pages(service, calendar_id, **list_params):
+        events_list.extend(page.get('items', []))
+        sync_token = page.get('nextSyncToken')
+    return events_list, sync_token
 
-        page_token = events_result.get('nextPageToken', False)
-        if not page_token:
-            break
 
+def _get_sync_state_path(calendar_id: GoogleCalendar) -> str:
+    return os.path.join(SYNC_STATE_DIRECTORY, f"{get_calendar_name(calendar_id)}.json")
+
+
+def _load_sync_state(calendar_id: GoogleCalendar) -> Tuple[Optional[str], Dict[str, Dict]]:
+    """
+    Loads the sync token and the local snapshot of events (keyed by event ID) stored by the last incremental listing
+    """
+    path = _get_sync_state_path(calendar_id)
+    if path in _sync_states:
+        return _sync_states[path]
+    if not os.path.exists(path):
+        return None, dict()
+    with open(path, "r") as f:
+        state = json.load(f)
+    if state.get("fields") != LIST_FIELDS:
+        logger.warning("Listed event fields changed since the last sync - %s", get_calendar_name(calendar_id))
+        return None, dict()
+    _sync_states[path] = state["sync_token"], state["events"]
+    return _sync_states[path]
+
+
+def _save_sync_state(calendar_id: GoogleCalendar, sync_token: Optional[str], events: Dict[str, Dict]):
+    os.makedirs(SYNC_STATE_DIRECTORY, exist_ok=True)
+    path = _get_sync_state_path(calendar_id)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"sync_token": sync_token, "fields": LIST_FIELDS, "events": events}, f)
+    os.replace(f"{path}.tmp", path)  # atomic, so a crashed run can't leave a truncated snapshot behind
+    _sync_states[path] = sync_token, events
+
+
+def _sync_events(service, calendar_id: GoogleCalendar) -> List[Dict]:
+    """
+    Incrementally lists events by applying only the changes since the stored sync token to the local snapshot.
+    Falls back to a full resync if there is no token yet or if the API rejects it (410 Gone)
+    """
+    sync_token, events = _load_sync_state(calendar_id)
+    changes = None
+    if sync_token:
+        try:
+            logger.debug("Fetching changes since last sync - %s", get_calendar_name(calendar_id))
+            changes, next_sync_token = _fetch_event_pages(service, calendar_id, syncToken=sync_token)
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            logger.warning("Sync token expired - %s", get_calendar_name(calendar_id))
+
+    if changes is None:
+        logger.warning("Performing full resync - %s", get_calendar_name(calendar_id))
+        events = dict()
+        changes, next_sync_token = _fetch_event_pages(service, calendar_id)
+
+    logger.info("Applying %d changed events - %s", len(changes), get_calendar_name(calendar_id))
+    for event in changes:
+        if event.get('status') == 'cancelled':
+            events.pop(event['id'], None)
+        else:
+            events[event['id']] = event
+    _save_sync_state(calendar_id, next_sync_token, events)
+    return sorted(events.values(), key=lambda e: e['start']['dateTime'])
+
+
+def _list_events(service, calendar_id: GoogleCalendar, incremental=False,
+                 time_min: Optional[datetime] = None, time_max: Optional[datetime] = None) -> list:
+    """
+    :param time_min: only list events ending after this time. Sync tokens can't be combined with a time window, so
+                     this is ignored (along with time_max) when listing incrementally
+    :param time_max: only list events starting before this time
+    """
+    if incremental:
+        return _sync_events(service, calendar_id)
+    window = _get_window_params(time_min, time_max)
+    events_list, _ = _fetch_event_pages(service, calendar_id, orderBy='startTime', **window)
     return events_list
 
 
-def get_calendar_events(service, calendar_id: GoogleCalendar, future_only=False) -> list:
-    logger.debug(f"Retrieving existing events from Google Calendar - {get_calendar_name(calendar_id)}")
-    events = _list_events(service, calendar_id)
-    logger.info(f"Found {len(events)} existing events on calendar - {get_calendar_name(calendar_id)}")
-    logger.debug(f"Filtering calendar events for future: {future_only}")
+def _get_window_params(time_min: Optional[datetime], time_max: Optional[datetime]) -> Dict[str, str]:
+    window = dict()
+    if time_min:
+        window["timeMin"] = time_min.isoformat(timespec="seconds")
+    if time_max:
+        window["timeMax"] = time_max.isoformat(timespec="seconds")
+    return window
 
-    # assume no showings are from before January 1st, 1970
-    filter_date = (datetime.today() if future_only else datetime.fromtimestamp(int())).date()
-    filter_datetime = datetime(filter_date.year, filter_date.month, filter_date.day).isoformat(timespec="seconds")
-    filtered_events = [event for event in events if event["start"]["dateTime"] > filter_datetime]
+
+def _get_time_window(future_only: bool, horizon_days: Optional[int]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    :return: the start of today if only future events are requested, and the end of the horizon if one is provided.
+             The horizon gets an extra day so that showings past midnight on its last day are still included
+    """
+    today = datetime.now(PACIFIC_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+    time_min = today if future_only else None
+    time_max = today + timedelta(days=horizon_days + 1) if horizon_days else None
+    return time_min, time_max
+
+
+def _filter_by_start(events: List[Dict], time_min: Optional[datetime], time_max: Optional[datetime]) -> List[Dict]:
+    """
+    The API window matches on end time (and isn't applied to incremental listings), so still filter on start time
+    """
+    if time_min:
+        filter_datetime = time_min.replace(tzinfo=None).isoformat(timespec="seconds")
+        events = [event for event in events if event["start"]["dateTime"] > filter_datetime]
+    if time_max:
+        filter_datetime = time_max.replace(tzinfo=None).isoformat(timespec="seconds")
+        events = [event for event in events if event["start"]["dateTime"] < filter_datetime]
+    return events
+
+
+def get_calendar_events(service, calendar_id: GoogleCalendar, future_only=False, incremental=False,
+                        horizon_days: Optional[int] = None) -> list:
+    """
+    :param horizon_days: if provided, only return events starting within this many days (e.g., the scraped interval)
+    """
+    logger.debug("Retrieving existing events from Google Calendar - %s", get_calendar_name(calendar_id))
+    time_min, time_max = _get_time_window(future_only, horizon_days)
+    with metrics.timer("list_events", calendar=get_calendar_name(calendar_id)):
+        events = _list_events(service, calendar_id, incremental=incremental, time_min=time_min, time_max=time_max)
+    logger.info("Found %d existing events on calendar - %s", len(events), get_calendar_name(calendar_id))
+    logger.debug("Filtering calendar events for future: %s", future_only)
+
+    filtered_events = _filter_by_start(events, time_min, time_max)
     if future_only:
-        logger.info(f"Found {len(filtered_events)} future events on calendar - {get_calendar_name(calendar_id)}")
+        logger.info("Found %d future events on calendar - %s", len(filtered_events), get_calendar_name(calendar_id))
     return filtered_events
 
 
-def _remove_duplicate_events(calendar_id: GoogleCalendar):
-    api_credentials = _get_credentials()
-    service = build('calendar', 'v3', credentials=api_credentials)
+def _get_maintenance_state_path(calendar_id: GoogleCalendar, operation: str) -> str:
+    return os.path.join(SYNC_STATE_DIRECTORY, f"{get_calendar_name(calendar_id)}.{operation}.json")
 
-    existing, duplicates = set(), 0
-    for event in get_calendar_events(service, calendar_id):
-        movie = _extract_movie(event)
-        if movie in existing:
-            service.events().delete(calendarId=calendar_id, eventId=event['id']).execute()
-            logger.info("Deleting duplicate")
-            duplicates += 1
-        else:
-            existing.add(movie)
-    logger.info(f"Deleted {duplicates} duplicates")
+
+def _load_maintenance_state(calendar_id: GoogleCalendar, operation: str) -> Optional[Dict]:
+    """
+    :return: where an interrupted run of the maintenance operation left off, if one did
+    """
+    path = _get_maintenance_state_path(calendar_id, operation)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        state = json.load(f)
+    logger.warning("Resuming interrupted %s from its last page - %s", operation, get_calendar_name(calendar_id))
+    return state
 
 
-def update_calendar(calendar_id: GoogleCalendar, theatre: SIFFTheatre):
-    api_credentials = _get_credentials()
-    service = build('calendar', 'v3', credentials=api_credentials)
+def _save_maintenance_state(calendar_id: GoogleCalendar, operation: str, state: Dict):
+    os.makedirs(SYNC_STATE_DIRECTORY, exist_ok=True)
+    path = _get_maintenance_state_path(calendar_id, operation)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
 
-    current_showings = {_extract_movie(e) for e in get_calendar_events(service, calendar_id, future_only=True)}
-    for showing in scrape_showings(theatre):
-        if showing not in current_showings:
-            event = _create_event(showing)
-            response = service.events().insert(calendarId=calendar_id, body=event).execute()
-            logger.info(f"Event created at {theatre} - {event['summary']}, {event['start']['dateTime']}"
-                        f"- {response.get('htmlLink')}")
 
-    deactivate_reminders(calendar_id, service)
+def _clear_maintenance_state(calendar_id: GoogleCalendar, operation: str):
+    path = _get_maintenance_state_path(calendar_id, operation)
+    if os.path.exists(path):
+        os.remove(path)
 
 
-def deactivate_reminders(calendar_id: GoogleCalendar, service=None):
+def _remove_duplicate_events(calendar_id: GoogleCalendar, resume=True):
+    """
+    Lists the calendar in start time order, so that duplicates are next to each other and only the events starting at
+    the current time need to be remembered. Each page's duplicates are deleted before moving on, and an interrupted
+    run picks up from the page it was on (see _save_maintenance_state)
+    :param resume: continue an interrupted run, rather than starting over
+    """
+    service = get_service()
+    calendar_name = get_calendar_name(calendar_id)
+
+    state = (_load_maintenance_state(calendar_id, "dedupe") if resume else None) or dict()
+    group_start, group = state.get("group_start"), set(state.get("group", list()))
+    deleted = 0
+    for page_token, page in iter_event_pages(service, calendar_id, page_token=state.get("page_token"),
+                                             orderBy='startTime'):
+        # the group carried over from the previous page, so duplicates split across pages are still caught
+        _save_maintenance_state(calendar_id, "dedupe",
+                                {"page_token": page_token, "group_start": group_start, "group": sorted(group)})
+        deletions = dict()
+        for event in page.get('items', []):
+            start = datetime.fromisoformat(event['start']['dateTime']).isoformat()
+            if start != group_start:
+                group_start, group = start, set()
+            key = extract_movie(event).identity_key
+            if key in group:
+                deletions[event['id']] = service.events().delete(calendarId=calendar_id, eventId=event['id'])
+            else:
+                group.add(key)
+
+        if deletions:
+            logger.info("Deleting %d duplicates", len(deletions))
+            _, errors = _execute_batch(service, deletions, calendar=calendar_name)
+            deleted += len(deletions) - len(errors)
+    _clear_maintenance_state(calendar_id, "dedupe")
+    logger.info("Deleted %d duplicates", deleted)
+
+
+def update_calendars(pairs: Iterable[Tuple[GoogleCalendar, SIFFTheatre]], shard: Optional["Shard"] = None,
+                     **update_options) -> int:
+    """
+    Updates the calendars in parallel, logging (rather than raising) any calendar's failure
+    :param shard: share the calendars with other workers, see src.sharding.update_shard
+    :param update_options: passed on to update_calendar
+    :return: the number of calendars that failed to update
+    """
+    if shard:
+        from src.sharding import update_shard  # imported here, since sharding is built on update_calendar
+        return update_shard(pairs, shard, **update_options)
+    pairs, failures = list(pairs), 0
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(update_calendar, calendar_id, theatre, **update_options)
+                   for calendar_id, theatre in pairs]
+        for (calendar_id, _), future in zip(pairs, futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                metrics.increment("calendar_update_failures", calendar=get_calendar_name(calendar_id))
+                logger.critical("An error occurred: %s", e)
+    return failures
+
+
+def update_calendar(calendar_id: GoogleCalendar, theatre: SIFFTheatre, incremental=True, interval_days=7,
+                    force=False, streaming=False, adaptive=False, sinks: Sequence[str] = ("google",)):
+    """
+    :param incremental: only fetch the calendar changes since the last run, see _sync_events
+    :param interval_days: how many days of showings to scrape. Calendar events are only listed for the same horizon
+    :param force: update the calendar even if none of the theatre's venue pages changed since the last run
+    :param streaming: write each day's showings to the calendar as soon as they're scraped, see _stream_to_sinks
+    :param adaptive: only fetch the venue pages that are due, reusing the last scrape of the others. This is what makes
+                     a horizon of several weeks affordable, see src.crawl_schedule
+    :param sinks: where to publish the showings, see src.sinks.SINKS
+    """
+    from src.sinks import create_sinks  # imported here, since the sinks are built on this module's API helpers
+    outputs = create_sinks(sinks, calendar_id, theatre, incremental=incremental, horizon_days=interval_days)
+    force = force or any(output.is_stale() for output in outputs)
+    if streaming:
+        _stream_to_sinks(calendar_id, theatre, outputs, interval_days, force, adaptive)
+        return
+
+    showings, changed = scrape_theatre(theatre, interval_days=interval_days, adaptive=adaptive)
+    if not (changed or force):
+        _log_skipped_update(calendar_id, theatre)
+        return
+
+    succeeded = False
+    try:
+        with metrics.timer("update_calendar", calendar=get_calendar_name(calendar_id)):
+            succeeded = _publish(outputs, [showings])
+    finally:
+        if not succeeded:
+            invalidate_venue_pages(theatre, interval_days)  # so the next run retries, even if the pages don't change
+
+
+def _log_skipped_update(calendar_id: GoogleCalendar, theatre: SIFFTheatre):
+    logger.info("No venue pages changed since the last run, skipping calendar update - %s", theatre)
+    metrics.increment("calendar_updates_skipped", calendar=get_calendar_name(calendar_id))
+
+
+def _publish(sinks: List["ShowingSink"], days: Iterable[List[MovieShowing]]) -> bool:
+    """
+    Writes each batch of showings to every sink, and only finishes the sinks once every batch was written, so an
+    interrupted run never removes showings that just hadn't been scraped yet
+    :return: whether every write succeeded
+    """
+    for sink in sinks:
+        sink.start()
+    written = True
+    for showings in days:
+        for sink in sinks:
+            written = sink.write(showings) and written
+    for sink in sinks:
+        written = sink.finish() and written
+    return written
+
+
+def _stream_to_sinks(calendar_id: GoogleCalendar, theatre: SIFFTheatre, sinks: List["ShowingSink"],
+                     interval_days: int, force: bool, adaptive: bool):
+    """
+    Publishes one day of showings at a time, while the following days are still being scraped. The sinks are only
+    started (e.g., the calendar listed) once the first changed venue page arrives
+    """
+    days = _stream_showings(theatre, interval_days, adaptive)
+    buffered, changed = list(), force
+    for showings, day_changed in days:
+        buffered.append(showings)
+        if changed or day_changed:
+            changed = True
+            break
+    if not changed:
+        _log_skipped_update(calendar_id, theatre)
+        return
+
+    succeeded = False
+    try:
+        with metrics.timer("update_calendar", calendar=get_calendar_name(calendar_id)):
+            succeeded = _publish(sinks, itertools.chain(buffered, (showings for showings, _ in days)))
+    finally:
+        days.close()
+        if not succeeded:
+            invalidate_venue_pages(theatre, interval_days)  # so the next run retries, even if the pages don't change
+
+
+def _stream_showings(theatre: SIFFTheatre, interval_days: int,
+                     adaptive: bool) -> Iterator[Tuple[List[MovieShowing], bool]]:
+    """
+    Scrapes the theatre on a background thread, handing each day's showings over through a queue of at most
+    STREAM_QUEUE_SIZE days, so that fetching pages overlaps with writing the calendar without the scraper running
+    arbitrarily far ahead. Errors raised while scraping are re-raised here
+    """
+    days = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stopped = threading.Event()
+    threading.Thread(target=_scrape_into, args=(days, stopped, theatre, interval_days, adaptive),
+                     name=f"scrape-{theatre}", daemon=True).start()
+    try:
+        while (day := days.get()) is not None:
+            if isinstance(day, Exception):
+                raise day
+            yield day
+    finally:
+        stopped.set()  # unblocks the scraper if the updater stops early
+
+
+def _scrape_into(days: queue.Queue, stopped: threading.Event, theatre: SIFFTheatre, interval_days: int,
+                 adaptive: bool):
+    """
+    The scraping thread of _stream_showings: puts each day's showings, then None once done, or the error raised
+    """
+    try:
+        with metrics.timer("scrape", theatre=theatre):
+            for day in iter_showings(theatre, interval_days=interval_days, adaptive=adaptive):
+                if not _put_unless_stopped(days, day, stopped):
+                    return
+        _put_unless_stopped(days, None, stopped)
+    except Exception as e:
+        _put_unless_stopped(days, e, stopped)
+
+
+def _put_unless_stopped(days: queue.Queue, item, stopped: threading.Event) -> bool:
+    """
+    :return: whether the item was put, rather than the consumer stopping while the queue was full
+    """
+    while not stopped.is_set():
+        try:
+            days.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _execute_plan(service, calendar_id: GoogleCalendar, plan: ReconciliationPlan) -> bool:
+    """
+    Executes every write of the plan through the batch endpoint
+    :return: whether every write succeeded
+    """
+    calendar_name = get_calendar_name(calendar_id)
+    requests = dict()
+    for i, event in enumerate(plan.inserts):
+        requests[f"insert-{i}"] = service.events().insert(calendarId=calendar_id, body=event, fields=INSERT_FIELDS)
+    for event_id, changes in plan.patches.items():
+        requests[f"patch-{event_id}"] = service.events().patch(calendarId=calendar_id, eventId=event_id,
+                                                               body=changes, fields="id")
+    for event_id in plan.deletes:
+        requests[f"delete-{event_id}"] = service.events().delete(calendarId=calendar_id, eventId=event_id)
+
+    with metrics.timer("write_events", calendar=calendar_name):
+        responses, errors = _execute_batch(service, requests, calendar=calendar_name)
+
+    for key, response in responses.items():
+        operation, identifier = key.split("-", 1)
+        if operation == "insert":
+            event = plan.inserts[int(identifier)]
+            logger.info("Event created - %s - %s, %s- %s", calendar_name, event['summary'], event['start']['dateTime'],
+                        response.get('htmlLink'))
+        elif operation == "patch":
+            logger.info("Event patched - %s - %s: %s", calendar_name, identifier, ', '.join(plan.patches[identifier]))
+        else:
+            event = plan.deletes[identifier]
+            logger.info("Event deleted - %s - %s, %s", calendar_name, event['summary'], event['start']['dateTime'])
+    for key in errors:
+        logger.error("Failed to %s - %s", key.replace('-', ' event ', 1), calendar_name)
+    return not errors
+
+
+def deactivate_reminders(calendar_id: GoogleCalendar, service=None, incremental=False,
+                         horizon_days: Optional[int] = None):
     """
     The API can mess up sometimes and add reminders. Iterate through events to flag them and remove reminders
     """
     if not service:
-        service = build('calendar', 'v3', credentials=_get_credentials())
-    for event in get_calendar_events(service, calendar_id, future_only=True):
-        if event['reminders'].get("overrides", list()):
-            event_info = f"{get_calendar_name(calendar_id)} - {event['start']['dateTime']} - {event['summary']}"
-            logger.warning(f"Deactivate event with reminders: {event_info}")
-            event['reminders'] = {"useDefault": False}
-            service.events().update(calendarId=calendar_id, eventId=event['id'], body=event).execute()
-
-
-def wipe_calendar(calendar_id: GoogleCalendar, future_only=False):
-    api_credentials = _get_credentials()
-    service = build('calendar', 'v3', credentials=api_credentials)
-
-    for event in get_calendar_events(service, calendar_id, future_only=future_only):
-        service.events().delete(calendarId=calendar_id, eventId=event['id']).execute()
-        logger.info(f"Deleted: {get_calendar_name(calendar_id)} - {event['summary']}, {event['start']['dateTime']}")
+        service = get_service()
+    if incremental:
+        pages = [get_calendar_events(service, calendar_id, future_only=True, incremental=True,
+                                     horizon_days=horizon_days)]
+    else:
+        time_min, time_max = _get_time_window(True, horizon_days)
+        pages = (events for _, events in _iter_window_pages(service, calendar_id, time_min, time_max))
+
+    for events in pages:
+        updates = dict()
+        for event in events:
+            if event['reminders'].get("overrides", list()):
+                event_info = f"{get_calendar_name(calendar_id)} - {event['start']['dateTime']} - {event['summary']}"
+                logger.warning("Deactivate event with reminders: %s", event_info)
+                event['reminders'] = {"useDefault": False}
+                # events are listed with partial fields, so patch rather than update to avoid clearing the rest
+                updates[event['id']] = service.events().patch(calendarId=calendar_id, eventId=event['id'],
+                                                              body={"reminders": event['reminders']}, fields="id")
+        _execute_batch(service, updates, calendar=get_calendar_name(calendar_id))
+
+
+def wipe_calendar(calendar_id: GoogleCalendar, future_only=False, resume=True):
+    """
+    Deletes the calendar's events a page at a time, while the next page is listed. An interrupted wipe picks up from
+    the page it was on (see _save_maintenance_state)
+    :param resume: continue an interrupted wipe, rather than starting over
+    """
+    service = get_service()
+    calendar_name = get_calendar_name(calendar_id)
+
+    state = (_load_maintenance_state(calendar_id, "wipe") if resume else None) or dict()
+    if state.get("future_only", future_only) != future_only:
+        state = dict()  # the interrupted wipe listed different events
+    time_min, _ = _get_time_window(future_only, None)
+    for page_token, events in _iter_window_pages(service, calendar_id, time_min, None,
+                                                 page_token=state.get("page_token")):
+        _save_maintenance_state(calendar_id, "wipe", {"page_token": page_token, "future_only": future_only})
+        events = {event['id']: event for event in events}
+        deletions = {event_id: service.events().delete(calendarId=calendar_id, eventId=event_id) for event_id in events}
+        responses, _ = _execute_batch(service, deletions, calendar=calendar_name)
+        for event_id in responses:
+            event = events[event_id]
+            logger.info("Deleted: %s - %s, %s", calendar_name, event['summary'], event['start']['dateTime'])
+    _clear_maintenance_state(calendar_id, "wipe")
+
+
+def _iter_window_pages(service, calendar_id: GoogleCalendar, time_min: Optional[datetime],
+                       time_max: Optional[datetime],
+                       page_token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+    """
+    :return: each page's token and the page's events that start within the window
+    """
+    for token, page in iter_event_pages(service, calendar_id, page_token=page_token, orderBy='startTime',
+                                        **_get_window_params(time_min, time_max)):
+        yield token, _filter_by_start(page.get('items', []), time_min, time_max)
 
 
 if __name__ == '__main__':
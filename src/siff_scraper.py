@@ -1,40 +1,332 @@
+import hashlib
 import json
-from functools import cache
-from typing import List
+import logging
+import multiprocessing
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import replace
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 
-import requests
+from src import transport
+from src.cache import PersistentCache
+from src.constants import SIFFTheatre, VENUE_SLUG_REGEX
+from src.crawl_schedule import CrawlScheduler
+from src.metrics import metrics
+from src.model import MovieShowing, ShowTime
+from src.util import (get_logger, get_date_delta, get_datetime_from_milliseconds, is_parseable_as_int,
+                      parse_html_subtrees, parse_int)
 
-from src.constants import SIFFTheatre
-from src.model import MovieShowing
-from src.util import *
+if TYPE_CHECKING:
+    import requests
 
 SIFF_ROOT = "https://siff.net"
+SCRAPE_CONCURRENCY = 8  # max simultaneous requests to siff.net, across every theatre being scraped
+CACHE_FILE = "cache.sqlite3"
+DESCRIPTION_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # synopses rarely change, but refresh them weekly regardless
+DESCRIPTION_CACHE_MAX_ENTRIES = 5000
+DESCRIPTION_LOCK_STRIPES = 64  # fixed, so a long-running daemon doesn't keep a lock per film it has ever seen
+PAGE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # a venue page is only reused for the date it was scraped for
+PAGE_CACHE_MAX_ENTRIES = 1000
+CRAWL_HISTORY_TTL_SECONDS = 30 * 24 * 60 * 60
+CRAWL_HISTORY_MAX_ENTRIES = 5000
+MAX_TRAILING_EMPTY_DAYS = 7  # a theatre with nothing listed for a week hasn't published the following days either
 
 logger = get_logger(__name__)
 
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+_fetch_slots = threading.BoundedSemaphore(SCRAPE_CONCURRENCY)  # shared by every theatre's scrape, see _fetch
+_caches = dict()
+_cache_lock = threading.Lock()
+_description_locks = [threading.Lock() for _ in range(DESCRIPTION_LOCK_STRIPES)]  # see _get_description
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_session() -> "requests.Session":
+    """
+    A single session shared by every thread, so that requests to siff.net reuse keep-alive connections
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            _session.mount(SIFF_ROOT, HTTPAdapter(pool_connections=1, pool_maxsize=SCRAPE_CONCURRENCY))
+    return _session
+
+
+def set_parse_processes(processes: Optional[int]):
+    """
+    Parses pages in a pool of worker processes rather than on the scraping threads, so that parsing for several
+    theatres isn't serialized by the GIL. Fetching, the caches and the metrics all stay in this process: workers are
+    only sent page content, and only send back showing records or descriptions
+    :param processes: the number of worker processes, or None to parse on the scraping threads again
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown()
+        # spawned rather than forked, since forking a process with running threads can copy locks that are held
+        _parse_pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                          initializer=_init_parse_worker, initargs=(SIFF_ROOT,)) \
+            if processes else None
+
+
+def _init_parse_worker(siff_root: str):
+    global SIFF_ROOT
+    SIFF_ROOT = siff_root  # film links are built from it while parsing
+
+
+def _parse(parser: Callable, content: bytes):
+    with _parse_pool_lock:
+        pool = _parse_pool
+    return parser(content) if pool is None else pool.submit(parser, content).result()
+
+
+def _get_cache(table: str, ttl_seconds: float, max_entries: int) -> PersistentCache:
+    with _cache_lock:
+        if table not in _caches:
+            _caches[table] = PersistentCache(CACHE_FILE, table=table, ttl_seconds=ttl_seconds, max_entries=max_entries)
+    return _caches[table]
+
+
+def _get_description_cache() -> PersistentCache:
+    return _get_cache("descriptions", DESCRIPTION_CACHE_TTL_SECONDS, DESCRIPTION_CACHE_MAX_ENTRIES)
+
+
+def _get_page_cache() -> PersistentCache:
+    return _get_cache("venue_pages", PAGE_CACHE_TTL_SECONDS, PAGE_CACHE_MAX_ENTRIES)
+
+
+def _get_crawl_scheduler() -> CrawlScheduler:
+    return CrawlScheduler(_get_cache("crawl_history", CRAWL_HISTORY_TTL_SECONDS, CRAWL_HISTORY_MAX_ENTRIES))
+
+
+def invalidate_description(title_page_url: Optional[str] = None):
+    """
+    Drops the cached description of the given movie page, or every cached description if no page is provided
+    """
+    _get_description_cache().invalidate(title_page_url)
 
-def scrape_showings(theatre: SIFFTheatre = SIFFTheatre.EGYPTIAN, interval_days=7) -> List[MovieShowing]:
-    assert theatre in SIFFTheatre
-    assert interval_days > 0
 
-    movies = list()
+def invalidate_venue_pages(theatre: SIFFTheatre, interval_days=7):
+    """
+    Drops the cached venue pages of the theatre, so that the next scrape reports them as changed
+    """
     for i in range(interval_days):
-        dated_url = f"{SIFF_ROOT}/cinema/cinema-venues/{theatre}?day={i}"
-        showings = scrape_page_calendar(dated_url)
+        _get_page_cache().invalidate(_get_page_cache_key(theatre, i))
+
+
+def scrape_showings(theatre: SIFFTheatre = SIFFTheatre.EGYPTIAN, interval_days=7,
+                    concurrency=SCRAPE_CONCURRENCY, adaptive=False) -> List[MovieShowing]:
+    return scrape_theatre(theatre, interval_days, concurrency, adaptive)[0]
+
+
+def scrape_theatre(theatre: SIFFTheatre = SIFFTheatre.EGYPTIAN, interval_days=7,
+                   concurrency=SCRAPE_CONCURRENCY, adaptive=False) -> Tuple[List[MovieShowing], bool]:
+    """
+    Scrapes every day's venue page and then the page of every film playing, with up to `concurrency` requests in
+    flight at once. Showings are returned in page order, as if each page had been scraped in turn
+    :return: the showings, and whether any venue page changed since it was last scraped
+    """
+    movies, changed = list(), False
+    with metrics.timer("scrape", theatre=theatre):
+        for showings, day_changed in iter_showings(theatre, interval_days, concurrency, adaptive):
+            movies.extend(showings)
+            changed = changed or day_changed
+    return movies, changed
+
+
+def iter_showings(theatre: SIFFTheatre = SIFFTheatre.EGYPTIAN, interval_days=7, concurrency=SCRAPE_CONCURRENCY,
+                  adaptive=False) -> Iterator[Tuple[List[MovieShowing], bool]]:
+    """
+    Yields each day's showings as soon as that day's venue page and its films' pages are scraped, in day order.
+    Venue pages are requested up to `concurrency` days ahead, and film pages as soon as a venue page lists them, with
+    up to `concurrency` requests in flight at once. Stops early once MAX_TRAILING_EMPTY_DAYS days in a row list nothing
+    :param adaptive: only fetch the venue pages the crawl schedule says are due, see CrawlScheduler
+    :return: for each day, the showings and whether the venue page changed since it was last scraped
+    """
+    assert re.match(VENUE_SLUG_REGEX, theatre)
+    assert interval_days > 0
+    assert concurrency > 0
+
+    summary = ScrapeSummary(theatre)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        daily_listings = deque(executor.submit(_scrape_venue_day, theatre, day, adaptive)
+                               for day in range(min(concurrency, interval_days)))
+        descriptions = dict()  # film page -> future
+        empty_days = 0
+        for day in range(interval_days):
+            showings, changed = daily_listings.popleft().result()
+            empty_days = 0 if showings else empty_days + 1
+            stopping = empty_days >= MAX_TRAILING_EMPTY_DAYS and day + 1 < interval_days
+            if not stopping and day + concurrency < interval_days:
+                daily_listings.append(executor.submit(_scrape_venue_day, theatre, day + concurrency, adaptive))
+            for link in dict.fromkeys(s.link for s in showings):
+                if link not in descriptions:
+                    descriptions[link] = executor.submit(_get_description, link)
+            showings = [replace(s, description=descriptions[s.link].result()) for s in showings]
+            summary.add(day, showings)
+            yield showings, changed
+
+            if stopping:
+                logger.info("Nothing listed at %s for %d days, stopping at %s", theatre, empty_days, get_date_delta(day))
+                for daily_listing in daily_listings:
+                    daily_listing.cancel()
+                break
+    summary.log()
+
+
+class ScrapeSummary:
+    """
+    Running totals of a theatre's scrape, so that the summary can be logged without keeping every showing around
+    """
+
+    def __init__(self, theatre: SIFFTheatre):
+        self.theatre = theatre
+        self.showing_count = 0
+        self.movies_playing = dict()  # ordered set
+
+    def add(self, day: int, showings: List[MovieShowing]):
         if not showings:
-            logger.warning(f"No movie listing found for provided date ({get_date_delta(i)}) at {theatre}")
-        movies.extend(showings)
+            logger.warning("No movie listing found for provided date (%s) at %s", get_date_delta(day), self.theatre)
+        self.showing_count += len(showings)
+        self.movies_playing.update((f"{s.title} ({s.year})", None) for s in showings)
+
+    def log(self):
+        logger.info("Found %d showings for the week of %s for %s", self.showing_count, get_date_delta(0), self.theatre)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Movies currently playing at %s: %s", self.theatre, ", ".join(self.movies_playing))
+
+
+def _fetch(url, page_type: str, headers=None, **labels) -> "requests.Response":
+    """
+    Fetches the page with timeouts, retrying transient failures, see src.transport
+    :raises requests.HTTPError: for an error response (e.g., after the last retry), so that error pages are never parsed
+                                or cached as listings
+    """
+    import requests
+    session = _get_session()
+
+    def send():
+        # theatres are scraped concurrently, each with up to SCRAPE_CONCURRENCY threads, but the session only pools as
+        # many connections, so requests beyond that would each open (and then discard) a connection
+        with _fetch_slots:
+            return session.get(url, headers=headers, timeout=transport.TIMEOUTS)
+
+    response = transport.call(urlparse(url).netloc, send, _is_retryable, _is_throttled)
+    metrics.increment("http_requests", page=page_type, status=response.status_code, **labels)
+    metrics.increment("http_bytes_downloaded", len(response.content), page=page_type, **labels)
+    if response.status_code != 304 and not 200 <= response.status_code < 300:
+        raise requests.HTTPError(f"{response.status_code} response from {url}", response=response)
+    return response
+
+
+def _is_retryable(outcome) -> bool:
+    import requests
+    if isinstance(outcome, Exception):
+        return isinstance(outcome, (requests.ConnectionError, requests.Timeout))
+    return outcome.status_code in transport.RETRYABLE_STATUS_CODES
 
-    movies_playing = ", ".join(set(f"{m.title} ({m.year})" for m in movies))
-    logger.info(f"Found {len(movies)} showings for the week of {get_date_delta(0)} for {theatre}")
-    logger.info(f"Movies currently playing at {theatre}: {movies_playing}")
-    return movies
+
+def _is_throttled(outcome) -> bool:
+    return not isinstance(outcome, Exception) and outcome.status_code == transport.THROTTLED_STATUS_CODE
 
 
 def scrape_page_calendar(url) -> List[MovieShowing]:
-    logger.debug(f"Scraping {url}")
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    return [replace(s, description=_get_description(s.link)) for s in _scrape_listing(url)]
+
+
+def _get_venue_url(theatre: SIFFTheatre, day: int) -> str:
+    return f"{SIFF_ROOT}/cinema/cinema-venues/{theatre}?day={day}"
+
+
+def _get_page_cache_key(theatre: SIFFTheatre, day: int) -> str:
+    # the day parameter is relative to today, so key on the date the page lists rather than on the URL
+    return f"{theatre}/{get_date_delta(day)}"
+
+
+def _scrape_venue_day(theatre: SIFFTheatre, day: int, adaptive=False) -> Tuple[List[MovieShowing], bool]:
+    """
+    :param adaptive: reuse the showings extracted last time without fetching the page, unless the page is due
+    :return: the showings (without descriptions), and whether the page changed since it was last scraped
+    """
+    if not adaptive:
+        return _fetch_venue_day(theatre, day)
+
+    cache_key, scheduler = _get_page_cache_key(theatre, day), _get_crawl_scheduler()
+    cached = _get_page_cache().get(cache_key)
+    if cached and not scheduler.is_due(cache_key, day):
+        logger.debug("Venue page not due for a fetch: %s", _get_venue_url(theatre, day))
+        metrics.increment("venue_pages_skipped", theatre=theatre)
+        return [MovieShowing.from_record(r) for r in json.loads(cached)["showings"]], False
+
+    showings, changed = _fetch_venue_day(theatre, day)
+    scheduler.record_fetch(cache_key, changed)
+    return showings, changed
+
+
+def _fetch_venue_day(theatre: SIFFTheatre, day: int) -> Tuple[List[MovieShowing], bool]:
+    """
+    Scrapes the showings on a venue page, reusing the showings extracted last time if the page is unchanged. Sends a
+    conditional request when the last response had validators, and falls back to comparing content digests
+    :return: the showings (without descriptions), and whether the page changed since it was last scraped
+    """
+    url, cache_key = _get_venue_url(theatre, day), _get_page_cache_key(theatre, day)
+    cached = json.loads(_get_page_cache().get(cache_key) or "null")
+    headers = dict()
+    if cached and cached["url"] == url:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    logger.debug("Scraping %s", url)
+    response = _fetch(url, "venue", headers=headers, theatre=theatre)
+    if cached and response.status_code == 304:
+        logger.debug("Venue page not modified: %s", url)
+        metrics.increment("cache_hits", cache="venue_pages", theatre=theatre)
+        return [MovieShowing.from_record(r) for r in cached["showings"]], False
+
+    digest = hashlib.sha256(response.content).hexdigest()
+    if cached and cached["digest"] == digest:
+        logger.debug("Venue page content unchanged: %s", url)
+        metrics.increment("cache_hits", cache="venue_pages", theatre=theatre)
+        records, changed = cached["showings"], False
+    else:
+        metrics.increment("cache_misses", cache="venue_pages", theatre=theatre)
+        with metrics.timer("parse", page="venue", theatre=theatre):
+            records, changed = _parse(_parse_listing_records, response.content), True
+
+    _get_page_cache().set(cache_key, json.dumps({
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "digest": digest,
+        "showings": records
+    }))
+    return [MovieShowing.from_record(r) for r in records], changed
+
+
+def _scrape_listing(url) -> List[MovieShowing]:
+    """
+    Scrapes the showings on a venue page, without following links to retrieve the movie descriptions
+    """
+    logger.debug("Scraping %s", url)
+    return _parse_listing(_fetch(url, "venue").content)
+
+
+def _parse_listing_records(content) -> List[Dict]:
+    return [s.to_record() for s in _parse_listing(content)]
+
+
+def _parse_listing(content) -> List[MovieShowing]:
+    soup = parse_html_subtrees(content, 'div', class_='listing')
     logger.debug("Successfully retrieved soup content")
 
     all_daily_showings = list()
@@ -44,24 +336,26 @@ def scrape_page_calendar(url) -> List[MovieShowing]:
         return all_daily_showings
 
     for movie in movie_listings.find_all("div", class_="item"):
-        logger.debug(f"Movie element: {movie}")
+        logger.debug("Movie element: %s", movie)
+        screenings = _extract_screenings(movie)
+        if not screenings:
+            continue
         title_element = movie.find('h3')
-        daily_showings = _extract_showings(movie)
-        locations = _extract_locations(movie)
-        meta = _get_metadata(meta_source=movie.find('div', class_='small-copy'),
-                             reference_showing=daily_showings[0] if daily_showings else None)
+        title, movie_link = title_element.text.strip(), _get_movie_link(title_element)
+        country, year, duration, director = _get_metadata(meta_source=movie.find('div', class_='small-copy'),
+                                                          reference_showing=screenings[0][0])
+        duration_minutes = parse_int(duration)
 
-        for showing, location in zip(daily_showings, locations):
-            movie_link = _get_movie_link(title_element)
+        for showing, location in screenings:
             all_daily_showings.append(MovieShowing(
-                title=title_element.text.strip(),
-                year=meta[1],
-                director=meta[3],
-                country=meta[0],
-                description=_get_description(movie_link),
+                title=title,
+                year=year,
+                director=director,
+                country=country,
+                description=None,
                 link=movie_link,
                 location=location,
-                duration_minutes=parse_int(meta[2]),
+                duration_minutes=duration_minutes,
                 showtime=showing
             ))
 
@@ -77,12 +371,12 @@ def _get_metadata(meta_source, reference_showing) -> List[str]:
     """
     meta = [m.strip() for m in meta_source.find('p', class_='meta').text.split("|")]
     reference_show_duration = str((reference_showing.end_time - reference_showing.start_time).seconds // 60) + " min."
-    logger.debug(f"Extracted metadata: {meta}")
+    logger.debug("Extracted metadata: %s", meta)
     if len(meta) != 4:
-        logger.warning(f"Attempting to correct incomplete metadata ({meta})")
+        logger.warning("Attempting to correct incomplete metadata (%s)", meta)
         fallback_year = f"{reference_showing.start_time.year}*"
         if len(meta) == 1:
-            logger.warning(f"Missing most of metadata...")
+            logger.warning("Missing most of metadata...")
             if "min." in meta[0]:
                 logger.warning("Assuming duration, filling other fields with unknown")
                 meta = ["Unknown Country", fallback_year, meta[0], "Unknown Director"]
@@ -110,7 +404,7 @@ def _get_metadata(meta_source, reference_showing) -> List[str]:
         else:
             logger.warning("... Missing too much of metadata")
             meta = ["Unknown Country", fallback_year, reference_show_duration, "Unknown Director"]
-        logger.warning(f"Corrected metadata: {meta}")
+        logger.warning("Corrected metadata: %s", meta)
     return meta
 
 
@@ -118,47 +412,60 @@ def _get_movie_link(title_element) -> str:
     return SIFF_ROOT + title_element.find('a').get('href')
 
 
-@cache
 def _get_description(title_page_url) -> str:
     """
-    Extracts the movie description by following the link to the movie page. Cached to avoid repeated requests
+    Extracts the movie description by following the link to the movie page. Cached on disk to avoid repeated requests,
+    both within a run (e.g., a movie playing at multiple theatres) and across runs
     """
-    logger.debug(f"Retrieving description from {title_page_url}")
-    response = requests.get(title_page_url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    cache = _get_description_cache()
+    # film pages share a lock when their URLs hash alike, so concurrent scrapes still fetch each page only once
+    with _description_locks[hash(title_page_url) % DESCRIPTION_LOCK_STRIPES]:
+        description = cache.get(title_page_url)
+        if description is None:
+            metrics.increment("cache_misses", cache="descriptions")
+            description = _fetch_description(title_page_url)
+            cache.set(title_page_url, description)
+        else:
+            metrics.increment("cache_hits", cache="descriptions")
+        return description
+
+
+def _fetch_description(title_page_url) -> str:
+    logger.debug("Retrieving description from %s", title_page_url)
+    response = _fetch(title_page_url, "film")
+    with metrics.timer("parse", page="film"):
+        return _parse(_parse_description, response.content)
+
+
+def _parse_description(content) -> str:
+    soup = parse_html_subtrees(content, "div", class_="body-copy")
     description_elements = soup.find("div", class_="body-copy").find_all("p")
-    description = "\n\n".join("".join(e.strings) for e in description_elements)  # ignore HTML formatting elements
-    return description
+    return "\n\n".join("".join(e.strings) for e in description_elements)  # ignore HTML formatting
 
 
-def __extract_screening_data(metadata_function, movie) -> List:
+def _extract_screenings(movie) -> List[Tuple[ShowTime, str]]:
     """
-    Extracts the JSON object containing screening data and parses it with the provided function
+    Extracts the showtime and venue of each screening, decoding each screening's JSON object once
     """
-    metadata = list()
+    screenings = list()
     for screening_time in movie.find('div', class_='times').find_all('a'):
         data_screening = screening_time.get('data-screening')
         if data_screening:
             data = json.loads(data_screening)
-            metadata.append(metadata_function(data))
-    return metadata
+            showtime = ShowTime(start_time=get_datetime_from_milliseconds(data["Showtime"]),
+                                end_time=get_datetime_from_milliseconds(data["ShowtimeEnd"]))
+            location = (f"{data['VenueName']}, {data['VenueAddress1']}, "
+                        f"{data['VenueCity']}, {data['VenueState']} {data['VenueZipCode']}")
+            screenings.append((showtime, location))
+    return screenings
 
 
 def _extract_showings(movie) -> List[ShowTime]:
-    def extract_showing(screening_data) -> ShowTime:
-        start_time = get_datetime_from_milliseconds(screening_data["Showtime"])
-        end_time = get_datetime_from_milliseconds(screening_data["ShowtimeEnd"])
-        return ShowTime(start_time, end_time)
-
-    return __extract_screening_data(extract_showing, movie)
+    return [showtime for showtime, _ in _extract_screenings(movie)]
 
 
 def _extract_locations(movie) -> List[str]:
-    def extract_location(data) -> str:
-        return (f"{data['VenueName']}, {data['VenueAddress1']}, "
-                f"{data['VenueCity']}, {data['VenueState']} {data['VenueZipCode']}")
-
-    return __extract_screening_data(extract_location, movie)
+    return [location for _, location in _extract_screenings(movie)]
 
 
 if __name__ == '__main__':
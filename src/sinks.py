@@ -0,0 +1,280 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Sequence
+
+from src.calendar_client import get_service
+from src.calendar_events import create_event
+from src.constants import SIFFTheatre, GoogleCalendar, PACIFIC_TIMEZONE
+from src.model import MovieShowing
+from src.reconciler import Reconciler, ScrapedShowings
+from src.showings_store import get_store
+from src.siff_calendar_updater import get_calendar_events, _execute_plan
+from src.util import get_logger
+
+ICS_DIRECTORY = 'feeds'
+ICS_RETENTION_DAYS = 30  # past showings are kept in the feed this long, so it doesn't grow forever
+ICS_PRODUCT_ID = "-//SIFFCalendarScraper//SIFF Showings//EN"
+ICS_UID_DOMAIN = "siff-calendar-scraper"
+ICS_DATETIME_FORMAT = "%Y%m%dT%H%M%SZ"
+ICS_MAX_LINE_OCTETS = 75
+
+logger = get_logger(__name__)
+
+
+class ShowingSink(ABC):
+    """
+    Somewhere scraped showings are published. An update starts the sink once it's known to be needed, writes the
+    showings in one or more batches (e.g., a day at a time when streaming), and finishes it once every showing has been
+    written, which is when showings that are no longer listed can be removed
+    """
+
+    def is_stale(self) -> bool:
+        """
+        :return: whether the sink must be updated even if no venue page changed (e.g., it was never written)
+        """
+        return False
+
+    def start(self):
+        pass
+
+    @abstractmethod
+    def write(self, showings: List[MovieShowing]) -> bool:
+        """
+        :return: whether every showing was published
+        """
+
+    def finish(self) -> bool:
+        """
+        :return: whether every removal was published
+        """
+        return True
+
+
+class GoogleCalendarSink(ShowingSink):
+    """
+    Inserts, patches and deletes the events of a Google Calendar so that it matches the showings, see Reconciler
+    """
+
+    def __init__(self, calendar_id: GoogleCalendar, theatre: SIFFTheatre, incremental=True, horizon_days=7):
+        """
+        :param incremental: only fetch the calendar changes since the last run
+        :param horizon_days: how many days of events to list, which should match the days of showings scraped
+        """
+        self.calendar_id = calendar_id
+        self.theatre = theatre
+        self.incremental = incremental
+        self.horizon_days = horizon_days
+        self.service = None
+        self.reconciler = None
+
+    def start(self):
+        self.service = get_service()
+        self.reconciler = Reconciler(get_calendar_events(self.service, self.calendar_id, future_only=True,
+                                                         incremental=self.incremental, horizon_days=self.horizon_days))
+
+    def write(self, showings: List[MovieShowing]) -> bool:
+        plan = self.reconciler.reconcile(showings)
+        logger.info("Reconciling %s: %d inserts, %d patches", self.theatre, len(plan.inserts), len(plan.patches))
+        return _execute_plan(self.service, self.calendar_id, plan)
+
+    def finish(self) -> bool:
+        plan = self.reconciler.finish()
+        logger.info("Reconciling %s: %d deletes", self.theatre, len(plan.deletes))
+        return _execute_plan(self.service, self.calendar_id, plan)
+
+
+class ICSFileSink(ShowingSink):
+    """
+    Maintains an iCalendar feed of the theatre's showings in ICS_DIRECTORY, for subscribers that don't need the Google
+    Calendar. Each showing's VEVENT has a UID derived from the showing's identity, so it's stable across runs, and a
+    VEVENT is only regenerated (with a new DTSTAMP) when the showing changed. The file is only rewritten if any VEVENT
+    changed, and is replaced atomically
+    """
+
+    def __init__(self, theatre: SIFFTheatre):
+        self.theatre = theatre
+        # e.g., "SIFF Cinema Uptown"
+        self.calendar_name = " ".join(w.upper() if w == "siff" else w.capitalize() for w in theatre.split("-"))
+        self.path = os.path.join(ICS_DIRECTORY, f"{theatre}.ics")
+        self._events: Dict[str, List[str]] = dict()  # UID -> folded VEVENT lines
+        self._scraped = ScrapedShowings()
+        self._changed = 0
+
+    def is_stale(self) -> bool:
+        return not os.path.exists(self.path)
+
+    def start(self):
+        self._events = _read_ics_events(self.path) if os.path.exists(self.path) else dict()
+
+    def write(self, showings: List[MovieShowing]) -> bool:
+        stamp = datetime.now(timezone.utc).strftime(ICS_DATETIME_FORMAT)
+        for showing in showings:
+            uid = get_ics_uid(showing)
+            if not self._scraped.add(uid, showing.showtime.start_time):
+                continue
+
+            lines = _create_vevent(uid, showing, stamp)
+            existing = self._events.get(uid)
+            if existing is None or _without_stamp(existing) != _without_stamp(lines):
+                self._events[uid] = lines
+                self._changed += 1
+        return True
+
+    def finish(self, now: datetime = None) -> bool:
+        """
+        Removes future showings on scraped dates that are no longer listed, and past showings older than
+        ICS_RETENTION_DAYS, then writes the feed if anything changed
+        """
+        now = now or datetime.now(PACIFIC_TIMEZONE)
+        for uid, lines in list(self._events.items()):
+            if uid in self._scraped:
+                continue
+            start = _get_start(lines)
+            if self._scraped.is_vanished(uid, start, now) or start < now - timedelta(days=ICS_RETENTION_DAYS):
+                del self._events[uid]
+                self._changed += 1
+
+        if self._changed or not os.path.exists(self.path):
+            logger.info("Writing %s: %d events, %d changed", self.path, len(self._events), self._changed)
+            self._write()
+        return True
+
+    def _write(self):
+        events = sorted(self._events.values(), key=_get_start)
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODUCT_ID}", "CALSCALE:GREGORIAN",
+                 "METHOD:PUBLISH", *_fold(f"X-WR-CALNAME:{escape_ics_text(self.calendar_name)}"),
+                 f"X-WR-TIMEZONE:{PACIFIC_TIMEZONE.zone}"]
+        lines.extend(line for event in events for line in event)
+        lines.append("END:VCALENDAR")
+
+        os.makedirs(ICS_DIRECTORY, exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8", newline="") as f:
+            f.write("\r\n".join(lines) + "\r\n")
+        os.replace(f"{self.path}.tmp", self.path)  # subscribers never fetch a partially written feed
+
+
+class ShowingsStoreSink(ShowingSink):
+    """
+    Keeps the theatre's showings in the local ShowingsStore, for lookups that shouldn't go through the Calendar API
+    """
+
+    def __init__(self, theatre: SIFFTheatre):
+        self.theatre = theatre
+        self.store = None
+        self._scraped = ScrapedShowings()
+        self._changed = 0
+
+    def is_stale(self) -> bool:
+        return get_store().count(self.theatre) == 0
+
+    def start(self):
+        self.store = get_store()
+
+    def write(self, showings: List[MovieShowing]) -> bool:
+        for showing in showings:
+            self._scraped.add(showing.identity_key, showing.showtime.start_time)
+        self._changed += self.store.upsert(self.theatre, showings)
+        return True
+
+    def finish(self, now: datetime = None) -> bool:
+        """
+        Removes future showings on scraped dates that are no longer listed
+        """
+        removed = self.store.remove_missing(self.theatre, self._scraped, now=now)
+        logger.info("Stored showings of %s: %d changed, %d removed", self.theatre, self._changed, removed)
+        return True
+
+
+SINKS = ("google", "ics", "store")
+
+
+def create_sinks(names: Sequence[str], calendar_id: GoogleCalendar, theatre: SIFFTheatre, incremental=True,
+                 horizon_days=7) -> List[ShowingSink]:
+    """
+    :param names: which of the SINKS to publish the theatre's showings to
+    """
+    sinks = list()
+    for name in names:
+        if name == "google":
+            sinks.append(GoogleCalendarSink(calendar_id, theatre, incremental=incremental, horizon_days=horizon_days))
+        elif name == "ics":
+            sinks.append(ICSFileSink(theatre))
+        elif name == "store":
+            sinks.append(ShowingsStoreSink(theatre))
+        else:
+            raise ValueError(f"Unknown sink: {name} (expected one of {', '.join(SINKS)})")
+    return sinks
+
+
+def get_ics_uid(showing: MovieShowing) -> str:
+    return f"{hashlib.sha256(showing.identity_key.encode()).hexdigest()[:32]}@{ICS_UID_DOMAIN}"
+
+
+def escape_ics_text(text: str) -> str:
+    """
+    Escapes a TEXT value (RFC 5545, section 3.3.11)
+    """
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> List[str]:
+    """
+    Splits a content line into lines of at most ICS_MAX_LINE_OCTETS octets, continued lines starting with a space
+    (RFC 5545, section 3.1). Never splits a UTF-8 character
+    """
+    folded, current, octets = list(), "", 0
+    for char in line:
+        size = len(char.encode("utf-8"))
+        limit = ICS_MAX_LINE_OCTETS - (1 if folded else 0)  # continued lines start with a space
+        if octets + size > limit:
+            folded.append(current)
+            current, octets = "", 0
+        current += char
+        octets += size
+    folded.append(current)
+    return [folded[0]] + [f" {part}" for part in folded[1:]]
+
+
+def _create_vevent(uid: str, showing: MovieShowing, stamp: str) -> List[str]:
+    event = create_event(showing)
+    start, end = (time.astimezone(timezone.utc).strftime(ICS_DATETIME_FORMAT)
+                  for time in (showing.showtime.start_time, showing.showtime.end_time))
+    properties = [f"UID:{uid}",
+                  f"DTSTAMP:{stamp}",
+                  f"DTSTART:{start}",
+                  f"DTEND:{end}",
+                  f"SUMMARY:{escape_ics_text(event['summary'])}",
+                  f"LOCATION:{escape_ics_text(event['location'])}",
+                  f"DESCRIPTION:{escape_ics_text(event['description'])}",
+                  f"URL:{showing.link}",
+                  "TRANSP:TRANSPARENT"]  # non-blocking on calendar, like the Google Calendar events
+    return ["BEGIN:VEVENT"] + [line for prop in properties for line in _fold(prop)] + ["END:VEVENT"]
+
+
+def _without_stamp(lines: List[str]) -> List[str]:
+    return [line for line in lines if not line.startswith("DTSTAMP:")]
+
+
+def _get_start(lines: List[str]) -> datetime:
+    start = next(line for line in lines if line.startswith("DTSTART:"))[len("DTSTART:"):]
+    return datetime.strptime(start, ICS_DATETIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def _read_ics_events(path: str) -> Dict[str, List[str]]:
+    """
+    Reads back the VEVENTs of a feed written by ICSFileSink, keeping their folded lines as they are
+    """
+    events, current = dict(), None
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line in f.read().split("\r\n"):
+            if line == "BEGIN:VEVENT":
+                current = [line]
+            elif current is not None:
+                current.append(line)
+                if line == "END:VEVENT":
+                    uid = next(line for line in current if line.startswith("UID:"))[len("UID:"):]
+                    events[uid], current = current, None
+    return events
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+from src.metrics import metrics
+from src.util import get_logger
+
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 30
+TIMEOUTS = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)  # as requests takes them
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 30
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+THROTTLED_STATUS_CODE = 429
+
+FAILURE_THRESHOLD = 5  # consecutive failed attempts that open a host's circuit
+CIRCUIT_RESET_SECONDS = 60  # how long an open circuit fails calls before letting one through again
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+_circuit_breakers: Dict[str, "CircuitBreaker"] = dict()
+_circuit_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a host that has been failing, see CircuitBreaker
+    """
+
+
+class TokenBucket:
+    """
+    Limits the rate of requests shared by every thread: tokens are added at `rate` per second up to `capacity`, and
+    each request takes as many as the calls it makes (e.g., one per call in a batch), waiting until they're available
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        :return: how many seconds were spent waiting for the tokens
+        """
+        tokens, waited = min(tokens, self.capacity), 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """
+        Empties the bucket, e.g., once the server asks for fewer requests, so that every thread waits for new tokens
+        """
+        with self._lock:
+            self._tokens = 0
+            self._updated_at = time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host after FAILURE_THRESHOLD consecutive failed attempts, so that a host that is down
+    costs each remaining request nothing rather than a timeout and several retries. After CIRCUIT_RESET_SECONDS, a
+    single request is let through, and its outcome closes the circuit or keeps it open for another period
+    """
+
+    def __init__(self, host: str, failure_threshold=FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self):
+        """
+        :raise CircuitOpenError: if the host shouldn't be sent a request right now
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                raise CircuitOpenError(f"Circuit open for {self.host} after {self._failures} failures")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit closed for %s", self.host)
+            self._failures, self._opened_at, self._probing = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.error("Circuit opened for %s after %d consecutive failures", self.host, self._failures)
+                    metrics.increment("circuit_breaker_opened", host=self.host)
+                self._opened_at = time.monotonic()
+
+
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(host)
+        return _circuit_breakers[host]
+
+
+def get_backoff_seconds(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so that threads retrying at the same time spread out
+    :param attempt: the number of attempts made so far
+    """
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def call(host: str, send: Callable[[], T], is_retryable: Callable[[object], bool],
+         is_throttled: Optional[Callable[[object], bool]] = None, rate_limiter: Optional[TokenBucket] = None,
+         cost: float = 1, max_attempts=MAX_ATTEMPTS) -> T:
+    """
+    Sends a request through the host's circuit breaker (and the rate limiter, if any), retrying with backoff
+    :param send: sends the request, returning the response or raising
+    :param is_retryable: whether a response or a raised exception is a transient failure worth another attempt. Those
+                         count against the host's circuit, while any other outcome shows the host is up
+    :param is_throttled: whether a retryable outcome is the host asking for fewer requests (e.g., a 429). Those are
+                         retried too, but show the host is up, and drain the rate limiter
+    :param cost: how many of the rate limiter's tokens the request takes
+    :return: the response of the last attempt. The exception raised by the last attempt is re-raised
+    """
+    breaker = get_circuit_breaker(host)
+    for attempt in range(max_attempts):
+        if attempt:
+            delay = get_backoff_seconds(attempt)
+            logger.warning("Retrying request to %s in %.1fs (attempt %d/%d)", host, delay, attempt + 1, max_attempts)
+            metrics.increment("http_retries", host=host)
+            time.sleep(delay)
+        breaker.before_call()
+        if rate_limiter:
+            waited = rate_limiter.acquire(cost)
+            if waited:
+                metrics.increment("rate_limit_wait_seconds", waited, host=host)
+
+        try:
+            outcome = send()
+        except Exception as e:
+            outcome = e
+        retry = _record_outcome(host, breaker, outcome, is_retryable, is_throttled, rate_limiter)
+        if not retry or attempt == max_attempts - 1:
+            break
+
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+
+def _record_outcome(host: str, breaker: CircuitBreaker, outcome, is_retryable: Callable[[object], bool],
+                    is_throttled: Optional[Callable[[object], bool]], rate_limiter: Optional[TokenBucket]) -> bool:
+    """
+    Records an attempt's response or raised exception with the host's circuit breaker
+    :return: whether the attempt failed transiently, and is worth retrying
+    """
+    if not is_retryable(outcome):
+        breaker.record_success()
+        return False
+    if is_throttled and is_throttled(outcome):
+        # only requests over quota are failing, so the circuit stays closed for the others
+        breaker.record_success()
+        metrics.increment("http_throttled", host=host)
+        if rate_limiter:
+            rate_limiter.drain()
+    else:
+        breaker.record_failure()
+    logger.warning("Request to %s failed: %s", host, outcome)
+    return True
@@ -1,22 +1,56 @@
+import atexit
+import importlib.util
 import logging
 import os
+import queue
 import re
+import threading
 from datetime import datetime, timedelta
-
-from bs4 import BeautifulSoup
+from logging.handlers import QueueHandler, QueueListener
+from typing import TYPE_CHECKING, Optional
 
 from src.constants import GoogleCalendar, PACIFIC_TIMEZONE, MILLISEC_PER_SEC
 from src.model import ShowTime
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# lxml is optional, but parses several times faster than the builtin parser when it is installed
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+LOG_FILE = "../update_calendar.log"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_log_listener: Optional[QueueListener] = None
+_log_lock = threading.Lock()
+
 
 def get_logger(filename, level=logging.INFO):
-    logger = logging.getLogger(filename)
-    logging.basicConfig(encoding='utf-8',
-                        filename="../update_calendar.log",
-                        level=level,
-                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    logger.addHandler(logging.StreamHandler())
-    return logger
+    """
+    Logging is configured on the first call (at the given level), after which this only returns the named logger
+    """
+    _configure_logging(level)
+    return logging.getLogger(filename)
+
+
+def _configure_logging(level):
+    """
+    Every logger propagates to a single queue, so logging a message only enqueues it. A background listener thread
+    writes the messages to the log file and to standard error, until the process exits
+    """
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+        file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _log_listener = QueueListener(log_queue, file_handler, logging.StreamHandler())
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(QueueHandler(log_queue))
+        _log_listener.start()
+        atexit.register(_log_listener.stop)  # flushes the queue
 
 
 def parse_int(text):
@@ -33,7 +67,10 @@ def get_date_delta(days_from_now: int) -> str:
 
 
 def get_datetime_from_milliseconds(data_time):
-    epoch_seconds = parse_int(data_time) / MILLISEC_PER_SEC
+    # SIFF timestamps look like "/Date(1723773600000)/", so slice the digits out rather than searching with a regex
+    digits = data_time[data_time.find("(") + 1:data_time.find(")")] if "(" in data_time else data_time
+    milliseconds = int(digits) if digits.isdigit() else parse_int(data_time)
+    epoch_seconds = milliseconds / MILLISEC_PER_SEC
     return datetime.fromtimestamp(epoch_seconds, tz=PACIFIC_TIMEZONE)
 
 
@@ -46,10 +83,26 @@ def is_parseable_as_int(string) -> bool:
 
 
 def get_calendar_name(calendar: GoogleCalendar) -> str:
-    return next(name for name, value in vars(GoogleCalendar).items() if value == calendar.value)
+    """
+    The calendar's GoogleCalendar name, or the name it was given in the calendar config (see src.registry)
+    """
+    try:
+        return GoogleCalendar(calendar).name
+    except ValueError:
+        from src.registry import get_configured_name  # imported here, since the registry logs through this module
+        return get_configured_name(calendar) or calendar
+
+
+def parse_html_subtrees(content, tag: str, class_: str) -> "BeautifulSoup":
+    """
+    Parses only the elements matching the tag and class (and their descendants), skipping the rest of the page
+    """
+    from bs4 import BeautifulSoup, SoupStrainer  # imported on first use, since runs with unchanged pages never parse
+    return BeautifulSoup(content, HTML_PARSER, parse_only=SoupStrainer(tag, class_=class_))
 
 
 def read_html_files(directory):
+    from bs4 import BeautifulSoup
     html_files = {}
 
     for root, dirs, files in os.walk(directory):
@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta
+
+from src.constants import PACIFIC_TIMEZONE
+from src.model import MovieShowing, ShowTime
+
+
+def make_showing(title="Crossing", start=datetime(2024, 8, 15, 19, 0), minutes=106, description="A film.",
+                 location="SIFF Cinema Egyptian") -> MovieShowing:
+    """
+    :param start: naive times are in Pacific time
+    """
+    start_time = start if start.tzinfo else PACIFIC_TIMEZONE.localize(start)
+    return MovieShowing(title=title, director="Levan Akin", country="Sweden", year="2024", description=description,
+                        link=f"https://siff.net/cinema/in-theaters/{title.lower().replace(' ', '-')}",
+                        location=location, duration_minutes=minutes,
+                        showtime=ShowTime(start_time, start_time + timedelta(minutes=minutes)))
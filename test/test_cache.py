@@ -0,0 +1,42 @@
+import unittest
+from unittest import mock
+
+from src.cache import PersistentCache
+
+
+class TestPersistentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PersistentCache(":memory:", table="entries", ttl_seconds=100, max_entries=3)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", "value")
+        self.assertEqual(self.cache.get("a"), "value")
+
+    def test_invalidate(self):
+        self.cache.set("a", "1")
+        self.cache.set("b", "2")
+        self.cache.invalidate("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), "2")
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_ttl_expiry(self):
+        with mock.patch("src.cache.time.time", return_value=1000):
+            self.cache.set("a", "1")
+        with mock.patch("src.cache.time.time", return_value=1101):
+            self.assertIsNone(self.cache.get("a"))
+
+    def test_size_eviction(self):
+        for i, key in enumerate("abcd"):
+            with mock.patch("src.cache.time.time", return_value=1000 + i):
+                self.cache.set(key, key)
+        with mock.patch("src.cache.time.time", return_value=1010):
+            self.assertIsNone(self.cache.get("a"))
+            self.assertEqual([self.cache.get(k) for k in "bcd"], ["b", "c", "d"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import threading
+import unittest
+from unittest import mock
+
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+import src.calendar_client as calendar_client
+
+
+class TestCalendarClient(unittest.TestCase):
+
+    def setUp(self):
+        credentials = Credentials(token="token")  # no expiry, so always valid
+        for patcher in (mock.patch("src.calendar_client._credentials", credentials),
+                        mock.patch("src.calendar_client._service", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_service_built_once(self):
+        with mock.patch("googleapiclient.discovery.build", wraps=discovery.build) as build:
+            services = set()
+            threads = [threading.Thread(target=lambda: services.add(id(calendar_client.get_service())))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(services), 1)
+        build.assert_called_once()
+
+    def test_requests_use_per_thread_transport(self):
+        service = calendar_client.get_service()
+        transports = list()
+
+        def create_requests():
+            first = service.events().list(calendarId="calendar")
+            second = service.events().list(calendarId="calendar")
+            self.assertIs(first.http, second.http)
+            transports.append(first.http)
+
+        threads = [threading.Thread(target=create_requests) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(transports), 2)
+        self.assertIsNot(transports[0], transports[1])
+
+
+class TestIsRetryable(unittest.TestCase):
+
+    @staticmethod
+    def error(status, reason=None):
+        content = json.dumps({"error": {"code": status, "message": "Error",
+                                        "errors": [{"domain": "usageLimits", "reason": reason}]}}) if reason else ""
+        return HttpError(Response({"status": status}), content.encode())
+
+    def test_only_rate_limiting_403s_retried(self):
+        self.assertTrue(calendar_client.is_retryable(self.error(403, "rateLimitExceeded")))
+        self.assertTrue(calendar_client.is_retryable(self.error(403, "userRateLimitExceeded")))
+        for reason in ("forbidden", "requiredAccessLevel", "quotaExceeded", None):
+            self.assertFalse(calendar_client.is_retryable(self.error(403, reason)))
+        self.assertTrue(calendar_client.is_retryable(self.error(503)))
+        self.assertFalse(calendar_client.is_retryable(self.error(404)))
+
+    def test_quota_errors_are_throttling(self):
+        for error in (self.error(429), self.error(403, "rateLimitExceeded"), self.error(403, "userRateLimitExceeded")):
+            self.assertTrue(calendar_client.is_retryable(error))
+            self.assertTrue(calendar_client.is_throttled(error))
+        for error in (self.error(503), self.error(403, "forbidden"), ConnectionError("reset")):
+            self.assertFalse(calendar_client.is_throttled(error))
+
+
+if __name__ == '__main__':
+    unittest.main()
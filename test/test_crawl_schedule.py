@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+from src.cache import PersistentCache
+from src.crawl_schedule import CrawlScheduler, DAY_SECONDS, FAR_REFETCH_INTERVAL
+
+
+class TestCrawlScheduler(unittest.TestCase):
+
+    def setUp(self):
+        history = PersistentCache(":memory:", table="crawl_history", ttl_seconds=30 * DAY_SECONDS, max_entries=100)
+        self.scheduler = CrawlScheduler(history)
+
+    def fetch(self, key, changed, at):
+        with mock.patch("src.crawl_schedule.time.time", return_value=at), \
+                mock.patch("src.cache.time.time", return_value=at):
+            self.scheduler.record_fetch(key, changed)
+
+    def is_due(self, key, days_out, at):
+        with mock.patch("src.crawl_schedule.time.time", return_value=at), \
+                mock.patch("src.cache.time.time", return_value=at):
+            return self.scheduler.is_due(key, days_out)
+
+    def test_unknown_pages_are_due(self):
+        self.assertTrue(self.scheduler.is_due("egyptian/2024-08-15", days_out=40))
+
+    def test_near_dates_are_always_due(self):
+        self.fetch("egyptian/2024-08-15", changed=False, at=1000)
+        self.assertTrue(self.is_due("egyptian/2024-08-15", days_out=1, at=1001))
+
+    def test_far_dates_wait_longer(self):
+        for _ in range(10):
+            self.fetch("egyptian/2024-08-15", changed=False, at=1000)
+        self.assertTrue(self.is_due("egyptian/2024-08-15", days_out=5, at=1000 + DAY_SECONDS))
+        self.assertFalse(self.is_due("egyptian/2024-08-15", days_out=40, at=1000 + DAY_SECONDS))
+        self.assertTrue(self.is_due("egyptian/2024-08-15", days_out=40, at=1000 + FAR_REFETCH_INTERVAL))
+
+    def test_changing_pages_are_fetched_sooner(self):
+        for key, changed in (("egyptian/2024-08-15", True), ("uptown/2024-08-15", False)):
+            for _ in range(5):
+                self.fetch(key, changed, at=1000)
+        with mock.patch("src.cache.time.time", return_value=1000):
+            self.assertGreater(self.scheduler.get_history("egyptian/2024-08-15").change_rate, 0.8)
+        self.assertTrue(self.is_due("egyptian/2024-08-15", days_out=40, at=1000 + DAY_SECONDS))
+        self.assertFalse(self.is_due("uptown/2024-08-15", days_out=40, at=1000 + DAY_SECONDS))
+
+
+if __name__ == '__main__':
+    unittest.main()
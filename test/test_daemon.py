@@ -0,0 +1,65 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.request import Request, urlopen
+
+from src.constants import GoogleCalendar, SIFFTheatre
+from src.daemon import UpdateDaemon
+
+
+class TestUpdateDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = list()
+        self.ran = threading.Semaphore(0)
+
+        def update_calendars(pairs, force=False, **update_options):
+            self.runs.append({"pairs": pairs, "force": force, **update_options})
+            self.ran.release()
+            return 0
+
+        patcher = mock.patch("src.daemon.update_calendars", side_effect=update_calendars)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.daemon = UpdateDaemon([(GoogleCalendar.SIFF_CINEMA_UPTOWN, SIFFTheatre.UPTOWN)], interval_seconds=3600,
+                                   jitter_seconds=60, interval_days=14)
+        server = self.daemon.start_server(port=0)
+        self.url = f"http://127.0.0.1:{server.server_address[1]}"
+        self.thread = threading.Thread(target=self.daemon.run_forever, daemon=True)
+        self.thread.start()
+        self.addCleanup(self.thread.join, 5)
+        self.addCleanup(self.daemon.stop)
+        self.assertTrue(self.ran.acquire(timeout=5))  # runs immediately on start
+
+    def wait_until_scheduled(self, runs):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            status = self.daemon.get_status()
+            if status["runs"] >= runs and status["next_run_at"] > status["last_run"]["started_at"]:
+                return
+            time.sleep(0.01)
+        self.fail(f"Run {runs} didn't finish")
+
+    def test_scheduled_run_on_start(self):
+        self.assertEqual(self.runs, [{"pairs": self.daemon.pairs, "force": False, "interval_days": 14}])
+
+    def test_refresh_requests_a_run(self):
+        with urlopen(Request(f"{self.url}/refresh?force=1", method="POST")) as response:
+            self.assertEqual(response.status, 202)
+        self.assertTrue(self.ran.acquire(timeout=5))
+        self.assertEqual([run["force"] for run in self.runs], [False, True])
+
+    def test_status(self):
+        self.wait_until_scheduled(runs=1)
+        with urlopen(f"{self.url}/status") as response:
+            status = json.load(response)
+        self.assertEqual(status["runs"], 1)
+        self.assertEqual(status["last_run"]["failures"], 0)
+        self.assertGreater(status["next_run_at"], status["last_run"]["started_at"] + 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
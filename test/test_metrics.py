@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.metrics import RunMetrics
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = RunMetrics()
+
+    def test_counters(self):
+        self.metrics.increment("http_requests", page="venue", theatre="egyptian")
+        self.metrics.increment("http_requests", page="venue", theatre="uptown")
+        self.metrics.increment("http_requests", 3, page="film")
+        self.assertEqual(self.metrics.get("http_requests"), 5)
+        self.assertEqual(self.metrics.get("http_requests", page="venue"), 2)
+        self.assertEqual(self.metrics.get("http_requests", theatre="uptown"), 1)
+        self.assertEqual(self.metrics.get("calendar_writes"), 0)
+
+    def test_timer(self):
+        with self.metrics.timer("scrape", theatre="egyptian"):
+            pass
+        phases = self.metrics.to_dict()["phases"]
+        self.assertEqual([(p["phase"], p["labels"]) for p in phases], [("scrape", {"theatre": "egyptian"})])
+
+    def test_prometheus(self):
+        self.metrics.increment("calendar_writes", operation="insert", calendar='quote"d')
+        with self.metrics.timer("list_events"):
+            pass
+        lines = self.metrics.to_prometheus().splitlines()
+        self.assertIn('siff_calendar_calendar_writes_total{calendar="quote\\"d",operation="insert"} 1', lines)
+        self.assertIn("# TYPE siff_calendar_calendar_writes_total counter", lines)
+        self.assertTrue(any(line.startswith('siff_calendar_phase_seconds{phase="list_events"} ') for line in lines))
+
+    def test_write_report(self):
+        self.metrics.increment("cache_hits", cache="descriptions")
+        with tempfile.TemporaryDirectory() as directory:
+            json_path, prometheus_path = os.path.join(directory, "r.json"), os.path.join(directory, "r.prom")
+            self.metrics.write_report(json_path, prometheus_path)
+            with open(json_path) as f:
+                self.assertEqual(json.load(f)["counters"][0]["value"], 1)
+            self.assertEqual(sorted(os.listdir(directory)), ["r.json", "r.prom"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from dataclasses import FrozenInstanceError, replace
+from datetime import datetime
+
+from src.constants import PACIFIC_TIMEZONE
+from src.model import ShowTime, HashableMovieEvent, MovieShowing
+
+
+class TestModel(unittest.TestCase):
+
+    def setUp(self):
+        self.showing = MovieShowing(title="Crossing", director="Levan Akin", country="Sweden", year="2024",
+                                    description="A film.", link="https://siff.net/cinema/in-theaters/crossing",
+                                    location="SIFF Cinema Egyptian", duration_minutes=106,
+                                    showtime=ShowTime(datetime(2024, 8, 15, 19, 0, tzinfo=PACIFIC_TIMEZONE),
+                                                      datetime(2024, 8, 15, 20, 46, tzinfo=PACIFIC_TIMEZONE)))
+
+    def test_calendar_event_matches_showing(self):
+        # events read back from the calendar have no end time, and a fixed-offset timezone
+        event = HashableMovieEvent(title="Crossing", year="2024", location="SIFF Cinema Egyptian",
+                                   showtime=ShowTime(datetime.fromisoformat("2024-08-15T19:00:00-07:00"), None))
+        self.assertEqual(event, self.showing)
+        self.assertIn(self.showing, {event})
+
+    def test_identity_ignores_other_fields(self):
+        self.assertEqual(replace(self.showing, description="Another description.", duration_minutes=90),
+                         self.showing)
+        self.assertNotEqual(replace(self.showing, location="SIFF Cinema Uptown"), self.showing)
+        self.assertNotEqual(self.showing, None)
+
+    def test_immutable(self):
+        with self.assertRaises(FrozenInstanceError):
+            self.showing.title = "Another title"
+        self.assertFalse(hasattr(self.showing, "__dict__"))
+
+    def test_record_round_trip(self):
+        restored = MovieShowing.from_record(self.showing.to_record())
+        self.assertEqual(restored, self.showing)
+        self.assertEqual(restored.to_record(), self.showing.to_record())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+from src.calendar_events import create_event
+from src.constants import PACIFIC_TIMEZONE
+from src.reconciler import Reconciler, ScrapedShowings
+from test import make_showing
+
+NOW = PACIFIC_TIMEZONE.localize(datetime(2024, 8, 15, 12, 0))
+
+
+def make_event(event_id, showing, **overrides):
+    return {**create_event(showing), "id": event_id, **overrides}
+
+
+class TestReconciler(unittest.TestCase):
+
+    def plan(self, events, showings):
+        reconciler = Reconciler(events)
+        plan = reconciler.reconcile(showings)
+        plan.extend(reconciler.finish(now=NOW))
+        return plan
+
+    def test_inserts_missing_showings(self):
+        existing, new = make_showing(), make_showing(title="Sing Sing")
+        plan = self.plan([make_event("a", existing)], [existing, new])
+        self.assertEqual([e["summary"] for e in plan.inserts], ["[Movie] Sing Sing (2024)"])
+        self.assertEqual(len(plan), 1)
+
+    def test_unchanged_calendar_needs_no_writes(self):
+        showing = make_showing()
+        event = make_event("a", showing)
+        event["end"] = {"dateTime": "2024-08-16T03:46:00Z"}  # same instant, different offset
+        self.assertEqual(len(self.plan([event], [showing])), 0)
+
+    def test_patches_only_changed_fields(self):
+        showing = make_showing()
+        changed = replace(make_showing(minutes=120), description="A longer film.")
+        plan = self.plan([make_event("a", showing)], [changed])
+        self.assertEqual(set(plan.patches["a"]), {"description", "end"})
+        self.assertEqual(plan.patches["a"]["end"]["dateTime"], "2024-08-15T21:00:00-07:00")
+
+    def test_patches_reminders(self):
+        showing = make_showing()
+        event = make_event("a", showing, reminders={"useDefault": False, "overrides": [{"method": "popup"}]})
+        plan = self.plan([event], [showing])
+        self.assertEqual(plan.patches, {"a": {"reminders": {"useDefault": False}}})
+
+    def test_deletes_duplicates(self):
+        showing = make_showing()
+        plan = self.plan([make_event("a", showing), make_event("b", showing)], [showing])
+        self.assertEqual(list(plan.deletes), ["b"])
+
+    def test_deletes_vanished_future_showings_on_scraped_dates(self):
+        kept = make_showing()
+        cancelled = make_showing(title="Cancelled", start=datetime(2024, 8, 15, 21, 0))
+        started = make_showing(title="Started", start=datetime(2024, 8, 15, 10, 0))
+        unscraped_date = make_showing(title="Later", start=datetime(2024, 8, 20, 19, 0))
+        events = [make_event(showing.title, showing) for showing in (kept, cancelled, started, unscraped_date)]
+        plan = self.plan(events, [kept])
+        self.assertEqual(list(plan.deletes), ["Cancelled"])
+
+
+class TestScrapedShowings(unittest.TestCase):
+
+    def test_vanished_showings(self):
+        scraped = ScrapedShowings()
+        late = NOW.replace(hour=23, minute=30).astimezone(timezone.utc)  # already the next day in UTC
+        self.assertTrue(scraped.add("late", late))
+        self.assertFalse(scraped.add("late", late))
+        self.assertIn("late", scraped)
+        self.assertFalse(scraped.is_vanished("late", late, NOW))
+        self.assertTrue(scraped.is_vanished("cancelled", NOW + timedelta(hours=1), NOW))
+        self.assertFalse(scraped.is_vanished("started", NOW - timedelta(hours=1), NOW))
+        self.assertFalse(scraped.is_vanished("unscraped", NOW + timedelta(days=1), NOW))
+
+
+if __name__ == '__main__':
+    unittest.main()
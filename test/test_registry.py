@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.constants import GoogleCalendar, SIFFTheatre
+from src.registry import load_pairs
+from src.util import get_calendar_name
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "calendars.json")
+        patcher = mock.patch.dict("src.registry._calendar_names", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_config(self, *calendars):
+        with open(self.path, "w") as f:
+            json.dump({"calendars": list(calendars)}, f)
+
+    def test_defaults_to_siff_theatres(self):
+        self.assertEqual(load_pairs(self.path), list(zip(GoogleCalendar, SIFFTheatre)))
+
+    def test_loads_festival_venues(self):
+        self.write_config({"calendar_id": GoogleCalendar.SIFF_CINEMA_UPTOWN.value, "theatre": "siff-cinema-uptown"},
+                          {"name": "FESTIVAL", "calendar_id": "festival@group.calendar.google.com",
+                           "theatre": "siff-festival-pacific-place"},
+                          {"calendar_id": "other@group.calendar.google.com", "theatre": "siff-festival-ark"})
+        pairs = load_pairs(self.path)
+        self.assertEqual([theatre for _, theatre in pairs],
+                         ["siff-cinema-uptown", "siff-festival-pacific-place", "siff-festival-ark"])
+        self.assertEqual([get_calendar_name(calendar_id) for calendar_id, _ in pairs],
+                         ["SIFF_CINEMA_UPTOWN", "FESTIVAL", "SIFF_FESTIVAL_ARK"])
+
+    def test_rejects_invalid_config(self):
+        self.write_config({"calendar_id": "a@group.calendar.google.com", "theatre": "../admin"})
+        with self.assertRaises(ValueError):
+            load_pairs(self.path)
+        self.write_config({"name": "A", "calendar_id": "a@group.calendar.google.com", "theatre": "siff-a"},
+                          {"name": "A", "calendar_id": "b@group.calendar.google.com", "theatre": "siff-b"})
+        with self.assertRaises(ValueError):
+            load_pairs(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
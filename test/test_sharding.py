@@ -0,0 +1,158 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from src.constants import GoogleCalendar, SIFFTheatre
+from src.sharding import LEASE_SECONDS, LeaseStore, Shard, _claim, get_shard_index, parse_shard, update_shard
+
+PAIRS = list(zip(GoogleCalendar, SIFFTheatre))
+
+
+class TestLeaseStore(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_lease_held_by_one_worker(self):
+        first, second = LeaseStore(self.directory, owner="first"), LeaseStore(self.directory, owner="second")
+        lease = first.try_acquire("UPTOWN")
+        self.assertIsNotNone(lease)
+        self.assertIsNone(second.try_acquire("UPTOWN"))
+        first.release(lease)
+        self.assertIsNotNone(second.try_acquire("UPTOWN"))
+
+    def test_expired_lease_taken_over_once(self):
+        dead = LeaseStore(self.directory, owner="dead", lease_seconds=60)
+        lease = dead.try_acquire("UPTOWN")
+        workers = [LeaseStore(self.directory, owner=f"worker{i}") for i in range(8)]
+        with mock.patch("src.sharding.time.time", return_value=time.time() + 120):
+            barrier, leases = threading.Barrier(len(workers)), list()
+
+            def take_over(worker):
+                barrier.wait()
+                leases.append(worker.try_acquire("UPTOWN"))
+
+            threads = [threading.Thread(target=take_over, args=(worker,)) for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len([lease for lease in leases if lease]), 1)
+            self.assertFalse(dead.renew(lease))
+        self.assertEqual(len([name for name in os.listdir(self.directory) if name.endswith(".lease")]), 1)
+
+    def test_takeover_only_logged_for_expired_leases(self):
+        first, second = LeaseStore(self.directory, owner="first"), LeaseStore(self.directory, owner="second")
+        first.release(first.try_acquire("UPTOWN"))
+        with self.assertNoLogs("src.sharding", level="WARNING"):
+            lease = second.try_acquire("UPTOWN")
+        with mock.patch("src.sharding.time.time", return_value=time.time() + LEASE_SECONDS + 1), \
+                self.assertLogs("src.sharding", level="WARNING"):
+            self.assertIsNotNone(first.try_acquire("UPTOWN"))
+        self.assertFalse(second.renew(lease))
+
+    def test_done_markers_expire(self):
+        leases = LeaseStore(self.directory, done_seconds=60)
+        self.assertFalse(leases.is_done("UPTOWN"))
+        leases.mark_done("UPTOWN")
+        self.assertTrue(leases.is_done("UPTOWN"))
+        with mock.patch("src.sharding.time.time", return_value=time.time() + 3600):
+            self.assertFalse(leases.is_done("UPTOWN"))
+
+    def test_hold_renews_lease(self):
+        leases = LeaseStore(self.directory, lease_seconds=0.06)
+        with leases.hold(leases.try_acquire("UPTOWN")):
+            threading.Event().wait(0.2)  # several times the lease's duration
+            self.assertIsNone(LeaseStore(self.directory).try_acquire("UPTOWN"))
+        self.assertIsNotNone(LeaseStore(self.directory).try_acquire("UPTOWN"))  # released
+
+
+class TestUpdateShard(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.updated = list()
+        self.lock = threading.Lock()
+
+        def update_calendar(calendar_id, theatre, **update_options):
+            with self.lock:
+                self.updated.append(theatre)
+            if theatre == SIFFTheatre.DOWNTOWN:
+                raise ConnectionError("siff.net is down")
+
+        patcher = mock.patch("src.siff_calendar_updater.update_calendar", side_effect=update_calendar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def shard(self, index, count, owner):
+        return Shard(index, count, LeaseStore(self.directory, owner=owner))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("1/3"), (1, 3))
+        for value in ("3/3", "1", "-1/3"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_workers_update_each_calendar_once(self):
+        shards = [self.shard(i, 3, owner=f"worker{i}") for i in range(3)]
+        failures = [0] * len(shards)
+
+        def work(i):
+            failures[i] = update_shard(PAIRS, shards[i], interval_days=7)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(shards))]
+        with mock.patch("src.sharding.POLL_SECONDS", 0.01):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(self.updated), sorted(SIFFTheatre))
+        self.assertEqual(sum(failures), 1)  # the failed calendar is only attempted once
+
+    def test_calendar_done_by_another_worker_not_claimed(self):
+        mine, other = self.shard(0, 1, owner="mine"), self.shard(0, 1, owner="other")
+        key = GoogleCalendar(PAIRS[0][0]).name
+        lease = other.leases.try_acquire(key)
+        other.leases.mark_done(key)
+        other.leases.release(lease)
+        self.assertEqual(list(_claim(mine, PAIRS[:1])), [])
+        self.assertIsNotNone(other.leases.try_acquire(key))  # the lease isn't left held
+
+    def test_takes_over_dead_workers_calendars(self):
+        dead = self.shard(0, 2, owner="dead")
+        held = [dead.leases.try_acquire(GoogleCalendar(c).name) for c, _ in PAIRS if c in dead]
+        self.assertTrue(held)
+        alive = self.shard(1, 2, owner="alive")
+        with mock.patch("src.sharding.POLL_SECONDS", 0), \
+                mock.patch("src.sharding.LeaseStore.try_acquire", autospec=True,
+                           side_effect=self.expire_after_first_wait(held)):
+            update_shard(PAIRS, alive)
+        self.assertEqual(sorted(self.updated), sorted(SIFFTheatre))
+        own = [theatre for calendar_id, theatre in PAIRS if get_shard_index(calendar_id, 2) == 1]
+        self.assertEqual(sorted(self.updated[:len(own)]), sorted(own))  # its own shard first
+
+    def expire_after_first_wait(self, held):
+        """
+        Simulates the dead worker's leases expiring once the live worker has had to wait on them
+        """
+        original, calls = LeaseStore.try_acquire, {"count": 0}
+
+        def try_acquire(store, key):
+            calls["count"] += 1
+            lease = original(store, key)
+            if lease is None and calls["count"] > len(PAIRS):
+                for dead_lease in held:
+                    LeaseStore(self.directory, owner="dead").release(dead_lease)
+            return lease
+        return try_acquire
+
+
+if __name__ == '__main__':
+    unittest.main()
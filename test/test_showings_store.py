@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from src.constants import PACIFIC_TIMEZONE, SIFFTheatre
+from src.reconciler import ScrapedShowings
+from src.showings_store import ShowingsStore, ShowingsRequestHandler, serve_showings
+from test import make_showing
+
+
+class TestShowingsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ShowingsStore(":memory:")
+        self.day = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 2, 19))
+        self.now = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 1, 12))
+
+    def test_upserts_only_changes(self):
+        self.assertEqual(self.store.upsert(SIFFTheatre.UPTOWN, [make_showing("Crossing", self.day),
+                                                                make_showing("Tár", self.day)]), 2)
+        self.assertEqual(self.store.upsert(SIFFTheatre.UPTOWN, [make_showing("Crossing", self.day)]), 0)
+        revised = make_showing("Crossing", self.day, description="Revised.")
+        self.assertEqual(self.store.upsert(SIFFTheatre.UPTOWN, [revised]), 1)
+        self.assertEqual(self.store.count(), 2)
+        self.assertEqual(self.store.query(title="Crossing")[0]["description"], "Revised.")
+
+    def test_removes_missing_future_showings_on_scraped_dates(self):
+        past = self.now - timedelta(hours=1)
+        self.store.upsert(SIFFTheatre.UPTOWN, [make_showing("Crossing", self.day), make_showing("Tár", self.day),
+                                               make_showing("Past", past),
+                                               make_showing("Later", self.day + timedelta(days=1))])
+        self.store.upsert(SIFFTheatre.EGYPTIAN, [make_showing("Elsewhere", self.day + timedelta(minutes=1))])
+        scraped = ScrapedShowings()
+        for listed in (make_showing("Crossing", self.day), make_showing("Earlier", past - timedelta(hours=1))):
+            scraped.add(listed.identity_key, listed.showtime.start_time)
+        removed = self.store.remove_missing(SIFFTheatre.UPTOWN, scraped, now=self.now)
+        self.assertEqual(removed, 1)
+        self.assertEqual([s["title"] for s in self.store.query()], ["Past", "Crossing", "Elsewhere", "Later"])
+
+    def test_query_filters(self):
+        self.store.upsert(SIFFTheatre.UPTOWN, [make_showing("Crossing", self.day + timedelta(days=d))
+                                               for d in range(5)])
+        self.store.upsert(SIFFTheatre.EGYPTIAN, [make_showing("Crossing", self.day + timedelta(minutes=30)),
+                                                 make_showing("Tár", self.day)])
+        self.assertEqual(len(self.store.query(title="crossing", year="2024")), 6)
+        self.assertEqual(len(self.store.query(title="Crossing", year="1999")), 0)
+        in_range = self.store.query(theatre=SIFFTheatre.UPTOWN, start=self.day + timedelta(days=1),
+                                    end=self.day + timedelta(days=3))
+        self.assertEqual([s["showtime"]["start_time"] for s in in_range],
+                         [(self.day + timedelta(days=d)).isoformat() for d in (1, 2)])
+        self.assertEqual({s["theatre"] for s in in_range}, {SIFFTheatre.UPTOWN})
+        self.assertEqual(len(self.store.query(limit=3)), 3)
+
+    def test_lookups_use_indexes(self):
+        for query, parameters in (("title = ? AND year = ?", ("Crossing", "2024")),
+                                  ("theatre = ? AND start_time >= ?", (SIFFTheatre.UPTOWN, 0)),
+                                  ("start_time >= ? AND start_time < ?", (0, 1))):
+            plan = self.store._connection.execute(f"EXPLAIN QUERY PLAN SELECT record FROM showings WHERE {query} "
+                                                  f"ORDER BY start_time", parameters).fetchall()
+            self.assertTrue(any("USING INDEX" in row[-1] for row in plan), plan)
+            self.assertFalse(any("TEMP B-TREE" in row[-1] for row in plan), plan)  # no sort either
+
+
+class TestShowingsRequestHandler(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        path = os.path.join(directory.name, "showings.sqlite3")
+        day = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 2, 19))
+        ShowingsStore(path).upsert(SIFFTheatre.UPTOWN, [make_showing("Crossing", day + timedelta(days=d))
+                                                        for d in range(3)])
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ShowingsRequestHandler)
+        self.server.store = ShowingsStore(path, read_only=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def get(self, path):
+        with urlopen(f"{self.url}{path}", timeout=5) as response:
+            return json.loads(response.read())
+
+    def test_lookup_by_film_and_dates(self):
+        showings = self.get("/showings?title=Crossing&theatre=siff-cinema-uptown&from=2030-08-03&to=2030-08-04")
+        self.assertEqual([s["showtime"]["start_time"][:10] for s in showings["showings"]], ["2030-08-03", "2030-08-04"])
+        self.assertEqual(len(self.get("/showings?limit=1")["showings"]), 1)
+
+    def test_bad_requests(self):
+        for path, status in (("/showings?from=August", 400), ("/showings?limit=-1", 400), ("/showings?limit=0", 400),
+                             ("/films", 404)):
+            with self.assertRaises(HTTPError) as error:
+                self.get(path)
+            self.assertEqual(error.exception.code, status)
+
+    def test_read_only(self):
+        day = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 2, 19))
+        with self.assertRaises(sqlite3.OperationalError):
+            self.server.store.upsert(SIFFTheatre.UPTOWN, [make_showing("Tár", day)])
+
+    def test_serving_requires_stored_showings(self):
+        with self.assertRaises(FileNotFoundError):
+            serve_showings(os.path.join(self.directory, "missing.sqlite3"), port=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
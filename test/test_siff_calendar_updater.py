@@ -0,0 +1,334 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+import src.siff_calendar_updater as updater
+from src.calendar_events import MOVIE_TITLE_PREFIX
+from test import make_showing
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = list()
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batch_sizes.append(len(self.requests))
+        for request_id, request in self.requests:
+            error = self.service.failures.get(request_id)
+            if error:
+                self.service.failures[request_id] = self.service.failures_after.get(request_id)
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, {"request": request}, None)
+
+
+class FakeService:
+    def __init__(self, failures=None, failures_after=None):
+        self.batch_sizes = list()
+        self.failures = failures or dict()
+        self.failures_after = failures_after or dict()
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+
+def fake_request(i):
+    return SimpleNamespace(methodId="calendar.events.insert", index=i)
+
+
+def http_error(status):
+    return HttpError(Response({"status": status}), b"")
+
+
+def isolate_transport(test_case: unittest.TestCase):
+    """
+    Lifts the Calendar API rate limit, and gives the test its own circuit breakers
+    """
+    for patcher in (mock.patch("src.calendar_client.rate_limiter", None),
+                    mock.patch.dict("src.transport._circuit_breakers", clear=True)):
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+@mock.patch("src.siff_calendar_updater.time.sleep")
+class TestExecuteBatch(unittest.TestCase):
+
+    def setUp(self):
+        isolate_transport(self)
+
+    def test_chunks_requests(self, _):
+        service = FakeService()
+        responses, errors = updater._execute_batch(service, {str(i): fake_request(i) for i in range(120)})
+        self.assertEqual(service.batch_sizes, [50, 50, 20])
+        self.assertEqual(len(responses), 120)
+        self.assertEqual(errors, dict())
+
+    def test_retries_only_failed_requests(self, _):
+        service = FakeService(failures={"3": http_error(503)})
+        responses, errors = updater._execute_batch(service, {str(i): fake_request(i) for i in range(5)})
+        self.assertEqual(service.batch_sizes, [5, 1])
+        self.assertEqual(responses["3"]["request"].index, 3)
+        self.assertEqual(errors, dict())
+
+    def test_does_not_retry_permanent_errors(self, _):
+        service = FakeService(failures={"1": http_error(404)})
+        responses, errors = updater._execute_batch(service, {str(i): fake_request(i) for i in range(3)})
+        self.assertEqual(service.batch_sizes, [3])
+        self.assertEqual(set(responses), {"0", "2"})
+        self.assertEqual(set(errors), {"1"})
+
+
+class FakeListRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeEventsResource:
+    def __init__(self, results):
+        self.results = results
+        self.calls = list()
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeListRequest(self.results.pop(0))
+
+
+class FakeListingService:
+    def __init__(self, *results):
+        self.resource = FakeEventsResource(list(results))
+
+    def events(self):
+        return self.resource
+
+
+def calendar_event(event_id, start="2024-08-15T19:00:00-07:00", **kwargs):
+    return {"id": event_id, "start": {"dateTime": start}, **kwargs}
+
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch("src.siff_calendar_updater.SYNC_STATE_DIRECTORY", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calendar = updater.GoogleCalendar.SIFF_CINEMA_UPTOWN
+
+    def test_applies_changes_to_snapshot(self):
+        full = {"items": [calendar_event("a"), calendar_event("b")], "nextSyncToken": "token-1"}
+        delta = {"items": [calendar_event("a", status="cancelled"), calendar_event("c", "2024-08-14T19:00:00-07:00")],
+                 "nextSyncToken": "token-2"}
+        service = FakeListingService(full, delta)
+
+        self.assertEqual([e["id"] for e in updater._list_events(service, self.calendar, incremental=True)], ["a", "b"])
+        self.assertEqual([e["id"] for e in updater._list_events(service, self.calendar, incremental=True)], ["c", "b"])
+        self.assertNotIn("syncToken", service.resource.calls[0])
+        self.assertEqual(service.resource.calls[1]["syncToken"], "token-1")
+        self.assertEqual(updater._load_sync_state(self.calendar)[0], "token-2")
+
+    def test_full_resync_when_token_gone(self):
+        updater._save_sync_state(self.calendar, "stale", {"x": calendar_event("x")})
+        service = FakeListingService(http_error(410), {"items": [calendar_event("a")], "nextSyncToken": "fresh"})
+
+        self.assertEqual([e["id"] for e in updater._list_events(service, self.calendar, incremental=True)], ["a"])
+        self.assertEqual(updater._load_sync_state(self.calendar)[0], "fresh")
+
+
+class TestTimeWindow(unittest.TestCase):
+
+    def test_window_pushed_to_api(self):
+        service = FakeListingService({"items": list()})
+        updater.get_calendar_events(service, updater.GoogleCalendar.SIFF_CINEMA_UPTOWN, future_only=True,
+                                    horizon_days=7)
+        call = service.resource.calls[0]
+        self.assertEqual(call["fields"], updater.LIST_FIELDS)
+        time_min, time_max = (datetime.fromisoformat(call["timeMin"]), datetime.fromisoformat(call["timeMax"]))
+        self.assertEqual((time_max - time_min).days, 8)
+
+    def test_full_history_without_window(self):
+        service = FakeListingService({"items": [calendar_event("a", "1999-01-01T19:00:00-08:00")]})
+        events = updater.get_calendar_events(service, updater.GoogleCalendar.SIFF_CINEMA_UPTOWN)
+        self.assertEqual([e["id"] for e in events], ["a"])
+        self.assertNotIn("timeMin", service.resource.calls[0])
+        self.assertNotIn("timeMax", service.resource.calls[0])
+
+
+class PagedCalendarService:
+    """
+    Lists events in pages whose tokens are cursors (as the API's are), and deletes them through batches
+    """
+
+    def __init__(self, events, page_size, fail_on_batch=None):
+        self.listed_events = list(events)
+        self.deleted = set()
+        self.page_size = page_size
+        self.fail_on_batch = fail_on_batch
+        self.list_calls = list()
+        self.batches = 0
+
+    def events(self):
+        return self
+
+    def list(self, pageToken=None, **kwargs):
+        self.list_calls.append(pageToken)
+        start = int(pageToken or 0)
+        remaining = [(i, e) for i, e in enumerate(self.listed_events) if i >= start and e["id"] not in self.deleted]
+        page = {"items": [e for _, e in remaining[:self.page_size]]}
+        if len(remaining) > self.page_size:
+            page["nextPageToken"] = str(remaining[self.page_size - 1][0] + 1)
+        return FakeListRequest(page)
+
+    def delete(self, calendarId, eventId):
+        return SimpleNamespace(methodId="calendar.events.delete", event_id=eventId)
+
+    def new_batch_http_request(self, callback=None):
+        self.batches += 1
+        if self.batches == self.fail_on_batch:
+            raise RuntimeError("interrupted")
+        batch = FakeBatch(FakeService(), callback)
+        service = self
+
+        def execute():
+            service.deleted.update(request.event_id for _, request in batch.requests)
+            FakeBatch.execute(batch)
+        batch.execute = execute
+        return batch
+
+
+def movie_event(event_id, title, hour):
+    return calendar_event(event_id, f"2024-08-15T{hour}:00:00-07:00", summary=f"{MOVIE_TITLE_PREFIX}{title} (2024)",
+                          location="SIFF Cinema Uptown", description="", end={"dateTime": "2024-08-15T23:00:00-07:00"})
+
+
+@mock.patch("src.siff_calendar_updater.time.sleep")
+class TestMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        isolate_transport(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch("src.siff_calendar_updater.SYNC_STATE_DIRECTORY", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calendar = updater.GoogleCalendar.SIFF_CINEMA_UPTOWN
+
+    def with_service(self, service):
+        patcher = mock.patch("src.siff_calendar_updater.get_service", return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return service
+
+    def test_prefetches_next_page(self, _):
+        service = PagedCalendarService([calendar_event(str(i)) for i in range(4)], page_size=2)
+        pages = updater.iter_event_pages(service, self.calendar)
+        next(pages)
+        for _ in range(100):  # the second page is listed in the background, before the first one is done
+            if len(service.list_calls) == 2:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(service.list_calls, [None, "2"])
+        self.assertEqual([token for token, _ in pages], ["2"])
+
+    def test_wipe_resumes_from_interrupted_page(self, _):
+        service = self.with_service(PagedCalendarService(
+            [movie_event(str(i), f"Movie {i}", 10 + i) for i in range(6)], page_size=2, fail_on_batch=2))
+        with self.assertRaises(RuntimeError):
+            updater.wipe_calendar(self.calendar)
+        self.assertEqual(service.deleted, {"0", "1"})
+
+        service.list_calls.clear()
+        updater.wipe_calendar(self.calendar)
+        self.assertEqual(service.list_calls[0], "2")
+        self.assertEqual(service.deleted, {str(i) for i in range(6)})
+        self.assertFalse(os.path.exists(updater._get_maintenance_state_path(self.calendar, "wipe")))
+
+    def test_removes_duplicates_across_pages(self, _):
+        events = [movie_event("a", "Alpha", 10), movie_event("b", "Beta", 10), movie_event("c", "Alpha", 10),
+                  movie_event("d", "Alpha", 12), movie_event("e", "Beta", 12), movie_event("f", "Beta", 12)]
+        service = self.with_service(PagedCalendarService(events, page_size=2))
+        updater._remove_duplicate_events(self.calendar)
+        self.assertEqual(service.deleted, {"c", "f"})
+
+    def test_dedupe_resumes_with_carried_over_group(self, _):
+        events = [movie_event("a", "Alpha", 10), movie_event("b", "Beta", 10), movie_event("c", "Alpha", 10),
+                  movie_event("d", "Alpha", 12)]
+        # the first page has no duplicates, so the batch for the second one fails
+        service = self.with_service(PagedCalendarService(events, page_size=2, fail_on_batch=1))
+        with self.assertRaises(RuntimeError):
+            updater._remove_duplicate_events(self.calendar)
+
+        service.list_calls.clear()
+        updater._remove_duplicate_events(self.calendar)
+        self.assertEqual(service.list_calls[0], "2")
+        self.assertEqual(service.deleted, {"c"})
+
+
+def showing(title, day):
+    return make_showing(title, datetime(2099, 8, day, 19), location="SIFF Cinema Uptown")
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar, self.theatre = updater.GoogleCalendar.SIFF_CINEMA_UPTOWN, updater.SIFFTheatre.UPTOWN
+        self.plans = list()
+        for patcher in (mock.patch("src.sinks.get_service"),
+                        mock.patch("src.sinks.get_calendar_events", return_value=list()),
+                        mock.patch("src.siff_calendar_updater.invalidate_venue_pages"),
+                        mock.patch("src.sinks._execute_plan",
+                                   side_effect=lambda service, calendar_id, plan: self.plans.append(plan) or True)):
+            self.addCleanup(patcher.stop)
+            setattr(self, patcher.attribute, patcher.start())
+
+    def stream(self, days, force=False):
+        with mock.patch("src.siff_calendar_updater.iter_showings", return_value=iter(days)):
+            updater.update_calendar(self.calendar, self.theatre, interval_days=len(days), force=force,
+                                    streaming=True)
+
+    def test_writes_each_day_as_it_arrives(self):
+        self.stream([([showing("A", 1)], False), ([showing("B", 2), showing("C", 2)], True), ([], False)])
+        self.assertEqual([len(plan.inserts) for plan in self.plans], [1, 2, 0, 0])
+        self.get_calendar_events.assert_called_once()
+        self.invalidate_venue_pages.assert_not_called()
+
+    def test_skips_unchanged_theatre(self):
+        self.stream([([showing("A", 1)], False), ([], False)])
+        self.get_service.assert_not_called()
+        self.assertEqual(self.plans, list())
+
+    def test_forced_update_of_unchanged_theatre(self):
+        self.stream([([showing("A", 1)], False)], force=True)
+        self.assertEqual([len(plan.inserts) for plan in self.plans], [1, 0])
+
+    def test_scraper_error_skips_deletions(self):
+        def days():
+            yield [showing("A", 1)], True
+            raise ConnectionError("siff.net is down")
+
+        with mock.patch("src.siff_calendar_updater.iter_showings", return_value=days()):
+            with self.assertRaises(ConnectionError):
+                updater.update_calendar(self.calendar, self.theatre, interval_days=2, streaming=True)
+        self.assertEqual(len(self.plans), 1)  # finish() was never planned
+        self.invalidate_venue_pages.assert_called_once_with(self.theatre, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
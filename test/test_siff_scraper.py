@@ -1,10 +1,20 @@
+import importlib.util
 import os
+import threading
+import time
 import unittest
 from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
 
-from src.constants import PACIFIC_TIMEZONE
+from src import siff_scraper, transport
+from src.constants import PACIFIC_TIMEZONE, SIFFTheatre
 from src.model import ShowTime
-from src.siff_scraper import _get_metadata, _extract_showings, _extract_locations
+from src.cache import PersistentCache
+from src.crawl_schedule import CrawlScheduler
+from src.siff_scraper import (_get_metadata, _extract_showings, _extract_locations, scrape_showings, scrape_theatre,
+                              iter_showings, invalidate_venue_pages, set_parse_processes, _parse_listing,
+                              _extract_screenings, _get_venue_url, _get_page_cache_key)
 from src.util import read_html_files, assert_equal_showtime
 
 
@@ -48,11 +58,250 @@ class TestSIFFScraper(unittest.TestCase):
                                       end_time=datetime(2024, 8, 15, 20, 46))]
         self.assertTrue(all(assert_equal_showtime(dt1, dt2) for dt1, dt2 in zip(showings, expected_showings)))
 
+    def test_extract_screenings(self):
+        screenings = _extract_screenings(self.test_files["movie"]["example.html"])
+        self.assertEqual(len(screenings), 1)
+        showtime, location = screenings[0]
+        self.assertTrue(assert_equal_showtime(showtime, ShowTime(start_time=datetime(2024, 8, 15, 19, 0),
+                                                                 end_time=datetime(2024, 8, 15, 20, 46))))
+        self.assertEqual(location, 'SIFF Cinema Egyptian, 805 East Pine Street, Seattle, WA 98122')
+
     def test_extract_locations(self):
         locations = _extract_locations(self.test_files["movie"]["example.html"])
         expected_locations = ['SIFF Cinema Egyptian, 805 East Pine Street, Seattle, WA 98122']
         self.assertEqual(locations, expected_locations)
 
 
+def make_venue_page(movie_html) -> bytes:
+    return f"""<!DOCTYPE html><html><head><title>SIFF</title><script>var x = '<div class="item">';</script></head>
+    <body><nav><div class="item"><h3><a href="/nav">Navigation</a></h3></div></nav>
+    <div class="listing">{movie_html}</div><footer><p>Footer</p></footer></body></html>""".encode()
+
+
+class TestParseListing(unittest.TestCase):
+
+    def setUp(self):
+        test_files = read_html_files("inputs" if os.getcwd().endswith("test") else "test/inputs")
+        self.page = make_venue_page(str(test_files["movie"]["example.html"]))
+
+    def test_parse_listing_ignores_rest_of_page(self):
+        showings = _parse_listing(self.page)
+        self.assertEqual([(s.title, s.year, s.director, s.country, s.link, s.duration_minutes) for s in showings],
+                         [("Crossing", "2024", "Levan Akin", "Sweden", "https://siff.net/cinema/in-theaters/crossing",
+                           106)])
+        self.assertEqual(showings[0].location, "SIFF Cinema Egyptian, 805 East Pine Street, Seattle, WA 98122")
+
+    @unittest.skipUnless(importlib.util.find_spec("lxml"), "lxml is not installed")
+    def test_parsers_agree(self):
+        with mock.patch("src.util.HTML_PARSER", "html.parser"):
+            builtin = _parse_listing(self.page)
+        with mock.patch("src.util.HTML_PARSER", "lxml"):
+            lxml = _parse_listing(self.page)
+        self.assertEqual(builtin, lxml)
+        self.assertEqual([s.to_record() for s in builtin], [s.to_record() for s in lxml])
+
+
+class FakeSIFFSession:
+    """
+    Serves the example movie on every other day's venue page, and a description for any film page
+    """
+
+    def __init__(self, movie_html, etag=None):
+        self.movie_html = movie_html
+        self.etag = etag
+        self.requested_urls = list()
+
+    def get(self, url, headers=None, **kwargs):
+        self.requested_urls.append(url)
+        if "?day=" in url:
+            if self.etag and (headers or dict()).get("If-None-Match") == self.etag:
+                return SimpleNamespace(content=b"", status_code=304, headers=dict())
+            day = int(url.split("?day=")[1])
+            listing = f'<div class="listing">{self.movie_html}</div>' if day % 2 == 0 else ""
+            return SimpleNamespace(content=f"<html><body>{listing}</body></html>".encode(), status_code=200,
+                                   headers={"ETag": self.etag} if self.etag else dict())
+        return SimpleNamespace(content=b'<div class="body-copy"><p>A <em>great</em> film.</p><p>Really.</p></div>',
+                               status_code=200, headers=dict())
+
+
+class TestScrapeShowings(unittest.TestCase):
+
+    def setUp(self):
+        test_files = read_html_files("inputs" if os.getcwd().endswith("test") else "test/inputs")
+        self.session = FakeSIFFSession(str(test_files["movie"]["example.html"]))
+        self.cache = PersistentCache(":memory:", table="descriptions", ttl_seconds=60, max_entries=10)
+        self.page_cache = PersistentCache(":memory:", table="venue_pages", ttl_seconds=60, max_entries=100)
+        self.scheduler = CrawlScheduler(PersistentCache(":memory:", table="crawl_history", ttl_seconds=60,
+                                                        max_entries=100))
+        for patcher in (mock.patch("src.siff_scraper._get_session", side_effect=lambda: self.session),
+                        mock.patch("src.siff_scraper._get_description_cache", return_value=self.cache),
+                        mock.patch("src.siff_scraper._get_page_cache", return_value=self.page_cache),
+                        mock.patch("src.siff_scraper._get_crawl_scheduler", return_value=self.scheduler),
+                        mock.patch.dict("src.transport._circuit_breakers", clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_scrape_showings(self):
+        showings = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=4)
+        self.assertEqual(len(showings), 2)
+        self.assertEqual(showings[0].title, "Crossing")
+        self.assertEqual(showings[0].link, "https://siff.net/cinema/in-theaters/crossing")
+        self.assertEqual(showings[0].description, "A great film.\n\nReally.")
+        self.assertEqual(showings[0].duration_minutes, 106)
+        film_requests = [url for url in self.session.requested_urls if "?day=" not in url]
+        self.assertEqual(film_requests, ["https://siff.net/cinema/in-theaters/crossing"])
+
+    def test_concurrent_theatres_share_the_request_limit(self):
+        get, lock, active = self.session.get, threading.Lock(), {"now": 0, "max": 0}
+
+        def slow_get(url, **kwargs):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.01)
+            with lock:
+                active["now"] -= 1
+            return get(url, **kwargs)
+
+        self.session.get = slow_get
+        with mock.patch("src.siff_scraper._fetch_slots", threading.BoundedSemaphore(2)):
+            threads = [threading.Thread(target=scrape_showings, args=(theatre,), kwargs=dict(interval_days=6))
+                       for theatre in SIFFTheatre]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(active["max"], 2)
+
+    def test_concurrency_preserves_order(self):
+        serial = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=6, concurrency=1)
+        self.cache.invalidate()
+        self.page_cache.invalidate()
+        concurrent = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=6, concurrency=4)
+        self.assertEqual(serial, concurrent)
+        self.assertEqual([s.description for s in serial], [s.description for s in concurrent])
+
+    def test_descriptions_cached_across_runs(self):
+        scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=2)
+        scrape_showings(SIFFTheatre.UPTOWN, interval_days=2)
+        film_requests = [url for url in self.session.requested_urls if "?day=" not in url]
+        self.assertEqual(len(film_requests), 1)
+
+    def test_concurrent_theatres_fetch_each_description_once(self):
+        get = self.session.get
+
+        def slow_film_get(url, **kwargs):
+            if "?day=" not in url:
+                time.sleep(0.05)
+            return get(url, **kwargs)
+
+        self.session.get = slow_film_get
+        threads = [threading.Thread(target=scrape_showings, args=(theatre,), kwargs=dict(interval_days=2))
+                   for theatre in SIFFTheatre]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        film_requests = [url for url in self.session.requested_urls if "?day=" not in url]
+        self.assertEqual(len(film_requests), 1)
+        self.assertEqual(len(siff_scraper._description_locks), siff_scraper.DESCRIPTION_LOCK_STRIPES)
+
+    def test_unchanged_pages_reuse_showings(self):
+        first, first_changed = scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)
+        second, second_changed = scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)
+        self.assertTrue(first_changed)
+        self.assertFalse(second_changed)
+        self.assertEqual(first, second)
+        self.assertEqual([s.description for s in first], [s.description for s in second])
+
+    def test_not_modified_pages_reuse_showings(self):
+        self.session = FakeSIFFSession(self.session.movie_html, etag='"v1"')
+        first, _ = scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)
+        with mock.patch("src.siff_scraper._parse_listing") as parse_listing:
+            second, changed = scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)
+        parse_listing.assert_not_called()
+        self.assertFalse(changed)
+        self.assertEqual(first, second)
+
+    def test_invalidated_pages_are_changed(self):
+        scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)
+        invalidate_venue_pages(SIFFTheatre.EGYPTIAN, interval_days=3)
+        self.assertTrue(scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=3)[1])
+
+    def test_process_mode_matches_thread_mode(self):
+        threaded = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=4)
+        self.cache.invalidate()
+        self.page_cache.invalidate()
+        set_parse_processes(2)
+        try:
+            with mock.patch("src.siff_scraper._parse_listing") as parse_listing:
+                processed = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=4)
+        finally:
+            set_parse_processes(None)
+        parse_listing.assert_not_called()  # parsed in the workers, which don't see the patch
+        self.assertEqual(threaded, processed)
+        self.assertEqual([s.description for s in threaded], [s.description for s in processed])
+
+    def test_transient_failures_retried_with_timeouts(self):
+        import requests
+        get, failures = self.session.get, [requests.Timeout("read timed out")]
+
+        def flaky_get(url, **kwargs):
+            self.assertEqual(kwargs["timeout"], (transport.CONNECT_TIMEOUT_SECONDS, transport.READ_TIMEOUT_SECONDS))
+            if "?day=" not in url and failures:
+                raise failures.pop()
+            return get(url, **kwargs)
+
+        self.session.get = flaky_get
+        with mock.patch("src.transport.time.sleep") as sleep:
+            showings = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=2)
+        self.assertEqual(showings[0].description, "A great film.\n\nReally.")
+        sleep.assert_called_once()
+
+    def test_error_pages_not_parsed_or_cached(self):
+        import requests
+        get, errors = self.session.get, dict()
+
+        def failing_get(url, **kwargs):
+            if url in errors:
+                return SimpleNamespace(content=b"<html><body>Error</body></html>", status_code=errors[url],
+                                       headers=dict())
+            return get(url, **kwargs)
+
+        self.session.get = failing_get
+        venue_url, film_url = _get_venue_url(SIFFTheatre.EGYPTIAN, 0), "https://siff.net/cinema/in-theaters/crossing"
+        errors[venue_url] = 503
+        with mock.patch("src.transport.time.sleep"), self.assertRaises(requests.HTTPError):
+            scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=1)
+        self.assertIsNone(self.page_cache.get(_get_page_cache_key(SIFFTheatre.EGYPTIAN, 0)))
+
+        errors.clear()
+        errors[film_url] = 404
+        with self.assertRaises(requests.HTTPError):
+            scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=1)
+        self.assertIsNone(self.cache.get(film_url))
+
+    def test_adaptive_scrape_skips_pages_not_due(self):
+        first = scrape_showings(SIFFTheatre.EGYPTIAN, interval_days=6, adaptive=True)
+        self.session.requested_urls.clear()
+        second, changed = scrape_theatre(SIFFTheatre.EGYPTIAN, interval_days=6, adaptive=True)
+        venue_requests = [url for url in self.session.requested_urls if "?day=" in url]
+        self.assertEqual(sorted(url.split("?day=")[1] for url in venue_requests), ["0", "1", "2"])  # the near days
+        self.assertFalse(changed)
+        self.assertEqual(first, second)
+
+    def test_stops_after_trailing_empty_days(self):
+        with mock.patch("src.siff_scraper.MAX_TRAILING_EMPTY_DAYS", 1):
+            days = list(iter_showings(SIFFTheatre.EGYPTIAN, interval_days=6, concurrency=1))
+        self.assertEqual([len(showings) for showings, _ in days], [1, 0])
+        self.assertEqual(len([url for url in self.session.requested_urls if "?day=" in url]), 2)
+
+    def test_iter_showings_yields_each_day(self):
+        days = list(iter_showings(SIFFTheatre.EGYPTIAN, interval_days=4))
+        self.assertEqual([len(showings) for showings, _ in days], [1, 0, 1, 0])
+        self.assertTrue(all(changed for _, changed in days))
+        self.assertEqual([s for showings, _ in days for s in showings], scrape_showings(SIFFTheatre.EGYPTIAN, 4))
+
+
 if __name__ == '__main__':
     unittest.main()
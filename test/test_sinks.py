@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from src.constants import PACIFIC_TIMEZONE, SIFFTheatre
+from src.showings_store import ShowingsStore
+from src.sinks import (ICSFileSink, ShowingSink, ShowingsStoreSink, escape_ics_text, get_ics_uid, _fold,
+                       ICS_MAX_LINE_OCTETS)
+from test import make_showing
+
+
+class TestICSFileSink(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch("src.sinks.ICS_DIRECTORY", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(directory.name, f"{SIFFTheatre.UPTOWN}.ics")
+        self.now = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 1, 12))
+        self.day = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 2, 19))
+
+    def publish(self, *showings):
+        sink = ICSFileSink(SIFFTheatre.UPTOWN)
+        sink.start()
+        sink.write(list(showings))
+        sink.finish(now=self.now)
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def test_writes_feed(self):
+        self.assertTrue(ICSFileSink(SIFFTheatre.UPTOWN).is_stale())
+        feed = self.publish(make_showing("Crossing", self.day))
+        self.assertTrue(feed.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(feed.endswith("END:VCALENDAR\r\n"))
+        self.assertIn("X-WR-CALNAME:SIFF Cinema Uptown\r\n", feed)
+        self.assertIn(f"UID:{get_ics_uid(make_showing('Crossing', self.day))}\r\n", feed)
+        self.assertIn("DTSTART:20300803T020000Z\r\n", feed)
+        self.assertIn("SUMMARY:[Movie] Crossing (2024)\r\n", feed)
+        self.assertFalse(ICSFileSink(SIFFTheatre.UPTOWN).is_stale())
+
+    def test_unchanged_showings_keep_their_vevent(self):
+        first = self.publish(make_showing("Crossing", self.day))
+        modified = os.path.getmtime(self.path)
+        with mock.patch("src.sinks.datetime") as clock:
+            clock.now.return_value = datetime(2030, 9, 1)
+            clock.strptime = datetime.strptime
+            self.assertEqual(self.publish(make_showing("Crossing", self.day)), first)
+        self.assertEqual(os.path.getmtime(self.path), modified)  # not rewritten
+
+    def test_changed_and_vanished_showings(self):
+        self.publish(make_showing("Crossing", self.day), make_showing("Tár", self.day + timedelta(hours=1)))
+        feed = self.publish(make_showing("Crossing", self.day, description="A different film."))
+        self.assertIn("A different film.", feed)
+        self.assertNotIn("Tár", feed)
+        self.assertEqual(feed.count("BEGIN:VEVENT"), 1)
+
+    def test_showings_on_dates_not_scraped_are_kept(self):
+        self.publish(make_showing("Crossing", self.day), make_showing("Tár", self.day + timedelta(days=1)))
+        feed = self.publish(make_showing("Crossing", self.day))
+        self.assertIn("Tár", feed)
+
+
+class TestShowingsStoreSink(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ShowingsStore(":memory:")
+        patcher = mock.patch("src.sinks.get_store", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 1, 12))
+        self.day = PACIFIC_TIMEZONE.localize(datetime(2030, 8, 2, 19))
+
+    def publish(self, *showings):
+        sink = ShowingsStoreSink(SIFFTheatre.UPTOWN)
+        sink.start()
+        sink.write(list(showings))
+        sink.finish(now=self.now)
+
+    def test_stores_showings(self):
+        self.assertTrue(ShowingsStoreSink(SIFFTheatre.UPTOWN).is_stale())
+        self.publish(make_showing("Crossing", self.day), make_showing("Tár", self.day + timedelta(days=1)))
+        self.assertFalse(ShowingsStoreSink(SIFFTheatre.UPTOWN).is_stale())
+        self.publish(make_showing("Crossing", self.day, description="A different film."))
+        self.assertEqual([(s["title"], s["description"]) for s in self.store.query()],
+                         [("Crossing", "A different film."), ("Tár", "A film.")])  # Tár's date wasn't scraped
+
+
+class TestShowingSink(unittest.TestCase):
+
+    def test_incomplete_sink_not_constructed(self):
+        class NoWrite(ShowingSink):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoWrite()
+
+
+class TestICSFormatting(unittest.TestCase):
+
+    def test_escape(self):
+        self.assertEqual(escape_ics_text("a, b; c\\d\ne"), "a\\, b\\; c\\\\d\\ne")
+
+    def test_fold(self):
+        line = "DESCRIPTION:" + "é" * 100
+        folded = _fold(line)
+        self.assertTrue(all(len(part.encode("utf-8")) <= ICS_MAX_LINE_OCTETS for part in folded))
+        self.assertTrue(all(part.startswith(" ") for part in folded[1:]))
+        self.assertEqual(folded[0] + "".join(part[1:] for part in folded[1:]), line)
+
+
+if __name__ == '__main__':
+    unittest.main()
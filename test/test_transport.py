@@ -0,0 +1,155 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src import transport
+from src.transport import CircuitBreaker, CircuitOpenError, TokenBucket
+
+
+def is_retryable(outcome) -> bool:
+    if isinstance(outcome, Exception):
+        return isinstance(outcome, ConnectionError)
+    return outcome.status_code in transport.RETRYABLE_STATUS_CODES
+
+
+def is_throttled(outcome) -> bool:
+    return not isinstance(outcome, Exception) and outcome.status_code == transport.THROTTLED_STATUS_CODE
+
+
+def responses(*outcomes):
+    """
+    :return: a request that returns (or raises) each outcome in turn, recording its calls
+    """
+    remaining = list(outcomes)
+
+    def send():
+        send.calls += 1
+        outcome = remaining.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(status_code=outcome)
+    send.calls = 0
+    return send
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    @mock.patch("src.transport.time.sleep")
+    @mock.patch("src.transport.time.monotonic", return_value=100.0)
+    def test_waits_for_tokens(self, monotonic, sleep):
+        bucket = TokenBucket(rate=10, capacity=50)
+        self.assertEqual(bucket.acquire(50), 0)
+        sleep.side_effect = lambda seconds: setattr(monotonic, "return_value", monotonic.return_value + seconds)
+        self.assertAlmostEqual(bucket.acquire(20), 2)
+        sleep.assert_called_once()
+
+    @mock.patch("src.transport.time.sleep")
+    @mock.patch("src.transport.time.monotonic", return_value=100.0)
+    def test_drained_bucket_waits_for_new_tokens(self, monotonic, sleep):
+        bucket = TokenBucket(rate=10, capacity=50)
+        bucket.drain()
+        sleep.side_effect = lambda seconds: setattr(monotonic, "return_value", monotonic.return_value + seconds)
+        self.assertAlmostEqual(bucket.acquire(10), 1)
+
+    @mock.patch("src.transport.time.sleep")
+    def test_costs_capped_at_capacity(self, sleep):
+        bucket = TokenBucket(rate=1, capacity=5)
+        self.assertEqual(bucket.acquire(80), 0)
+        sleep.assert_not_called()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    @mock.patch("src.transport.time.monotonic", return_value=0.0)
+    def test_opens_after_consecutive_failures(self, monotonic):
+        breaker = CircuitBreaker("example.com", failure_threshold=2, reset_seconds=10)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        monotonic.return_value = 10.0
+        breaker.before_call()  # a single probe is let through once the circuit has been open long enough
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+
+    @mock.patch("src.transport.time.monotonic", return_value=0.0)
+    def test_failed_probe_reopens(self, monotonic):
+        breaker = CircuitBreaker("example.com", failure_threshold=1, reset_seconds=10)
+        breaker.record_failure()
+        monotonic.return_value = 10.0
+        breaker.before_call()
+        breaker.record_failure()
+        monotonic.return_value = 15.0
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+
+@mock.patch("src.transport.time.sleep")
+class TestCall(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict("src.transport._circuit_breakers", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_transient_failures(self, sleep):
+        send = responses(ConnectionError("reset"), 503, 200)
+        self.assertEqual(transport.call("example.com", send, is_retryable).status_code, 200)
+        self.assertEqual(send.calls, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertFalse(transport.get_circuit_breaker("example.com").is_open)
+
+    def test_does_not_retry_permanent_failures(self, sleep):
+        send = responses(404)
+        self.assertEqual(transport.call("example.com", send, is_retryable).status_code, 404)
+        send = responses(ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            transport.call("example.com", send, is_retryable)
+        self.assertEqual(send.calls, 1)
+        sleep.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self, _):
+        send = responses(*[503] * transport.MAX_ATTEMPTS)
+        self.assertEqual(transport.call("example.com", send, is_retryable).status_code, 503)
+        send = responses(*[ConnectionError("reset")] * transport.MAX_ATTEMPTS)
+        with self.assertRaises(ConnectionError):
+            transport.call("example.org", send, is_retryable)
+        self.assertEqual(send.calls, transport.MAX_ATTEMPTS)
+
+    def test_open_circuit_fails_fast(self, _):
+        send = responses(*[503] * (transport.FAILURE_THRESHOLD + 1))
+        with self.assertRaises(CircuitOpenError):
+            transport.call("example.com", send, is_retryable, max_attempts=transport.FAILURE_THRESHOLD + 1)
+        self.assertEqual(send.calls, transport.FAILURE_THRESHOLD)
+        with self.assertRaises(CircuitOpenError):
+            transport.call("example.com", responses(200), is_retryable)
+        self.assertEqual(transport.call("example.org", responses(200), is_retryable).status_code, 200)
+
+    def test_throttling_never_opens_circuit(self, _):
+        rate_limiter = mock.Mock(spec=TokenBucket)
+        rate_limiter.acquire.return_value = 0
+        for _ in range(transport.FAILURE_THRESHOLD):
+            send = responses(*[429] * transport.MAX_ATTEMPTS)
+            response = transport.call("example.com", send, is_retryable, is_throttled, rate_limiter=rate_limiter)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(send.calls, transport.MAX_ATTEMPTS)
+        self.assertFalse(transport.get_circuit_breaker("example.com").is_open)
+        self.assertEqual(rate_limiter.drain.call_count, transport.FAILURE_THRESHOLD * transport.MAX_ATTEMPTS)
+        self.assertEqual(transport.call("example.com", responses(200), is_retryable, is_throttled).status_code, 200)
+
+    def test_rate_limiter_charged_per_attempt(self, _):
+        rate_limiter = mock.Mock(spec=TokenBucket)
+        rate_limiter.acquire.return_value = 0
+        transport.call("example.com", responses(503, 200), is_retryable, rate_limiter=rate_limiter, cost=50)
+        self.assertEqual(rate_limiter.acquire.call_args_list, [mock.call(50), mock.call(50)])
+
+
+if __name__ == '__main__':
+    unittest.main()
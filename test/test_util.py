@@ -1,4 +1,5 @@
 import unittest
+from logging.handlers import QueueHandler
 
 from src.util import *
 
@@ -8,6 +9,14 @@ class TestUtilMethods(unittest.TestCase):
         logger = get_logger(__file__)
         self.assertIsInstance(logger, logging.Logger)
 
+    def test_logging_configured_once(self):
+        get_logger(__file__)
+        handlers = list(logging.getLogger().handlers)
+        logger = get_logger(__file__)
+        self.assertEqual(logging.getLogger().handlers, handlers)
+        self.assertEqual(logger.handlers, list())  # propagates to the root logger's queue instead
+        self.assertEqual(sum(isinstance(h, QueueHandler) for h in handlers), 1)
+
     def test_parse_int(self):
         self.assertEqual(parse_int("123"), 123)
         self.assertEqual(parse_int("abc123def"), 123)
@@ -22,6 +31,8 @@ class TestUtilMethods(unittest.TestCase):
         milliseconds = 1723449313000
         expected_datetime = datetime(2024, 8, 12, 0, 55, 13, tzinfo=PACIFIC_TIMEZONE)
         self.assertEqual(get_datetime_from_milliseconds(str(milliseconds)).date(), expected_datetime.date())
+        self.assertEqual(get_datetime_from_milliseconds(f"/Date({milliseconds})/"),
+                         get_datetime_from_milliseconds(str(milliseconds)))
 
     def test_is_parseable_as_int(self):
         # Test cases where the input should be parseable as an integer